@@ -6,6 +6,7 @@ from __future__ import annotations
 from typing import Any, Literal as Lit, Annotated
 import pydantic as pyd
 from .config import Model, DefaultToolName, ModelName, PluginName
+from .profiling import profiled
 from . import contentref
 from .tool import Canvas
 
@@ -46,6 +47,7 @@ class TextContent(Model):
 
     @pyd.model_validator(mode='before')
     @classmethod
+    @profiled
     def convert_parts(cls, obj: Any) -> Any:
         if isinstance(obj, dict) and isinstance(obj.get('parts'), list):
             assert len(obj['parts']) == 1
@@ -76,6 +78,7 @@ class MultiModalTextContent(Model):
 
     @pyd.field_validator('parts', mode='before')
     @classmethod
+    @profiled
     def convert_text_parts(cls, parts: list) -> list:
         if any([isinstance(part, str) for part in parts]):
             # Convert string parts to TextContentPart
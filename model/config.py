@@ -2,8 +2,9 @@
 Constants and configurations for the project.
 """
 
-from typing import Literal as Lit
-from pydantic import BaseModel, ConfigDict
+from typing import Any, Literal as Lit
+from pydantic import BaseModel, ConfigDict, ModelWrapValidatorHandler, model_validator
+from .profiling import PROFILE_VALIDATION, model_name, timed
 
 
 def to_camel(name: str) -> str:
@@ -35,6 +36,13 @@ class Model(BaseModel):
         populate_by_name=True,
     )
 
+    if PROFILE_VALIDATION:
+
+        @model_validator(mode='wrap')
+        @classmethod
+        def profile_validation(cls, data: Any, handler: ModelWrapValidatorHandler) -> Any:
+            return timed(model_name(cls), handler, data)
+
 
 # !! CUSTOMIZE ME !!
 # Please set `PluginName` to a Literal with the names of the plugins you've used in
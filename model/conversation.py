@@ -1,11 +1,14 @@
 from __future__ import annotations
 from typing import Literal as Lit, Annotated, Any
+from collections.abc import Callable
 import pydantic as pyd
 from .user import UserMessage
 from .assistant import AssistantMessage
 from .system import SystemMessage
 from .tool import ToolMessage
 from .config import Model, ModelName
+from .profiling import profiled
+from .tree import TreeIndex
 
 
 class Conversation(Model):
@@ -40,18 +43,32 @@ class Conversation(Model):
     is_study_mode: bool | None = None
     mapping: dict[str, Node]
 
+    # Built on first use by `tree()`, along with the `mapping` it indexes
+    _tree: TreeIndex | None = pyd.PrivateAttr(default=None)
+    _tree_mapping: dict[str, Node] | None = pyd.PrivateAttr(default=None)
+    # Built on first use by `active_path()`
+    _active_path: list[Message] | None = pyd.PrivateAttr(default=None)
+
     @pyd.model_validator(mode='before')
     @classmethod
-    def nullify_empty_dicts(cls, obj: Any) -> Any:
+    @profiled
+    def nullify_empty_dicts(cls, obj: Any, info: pyd.ValidationInfo) -> Any:
         """
         Recursively nullify empty dictionaries in the model.
         This is useful for cleaning up the model before serialization.
+        Skipped when the input has already been through `normalize_conversation`.
         """
+        if is_normalized(info):
+            return obj
         return nullify_empty_dicts_rec(obj)
 
     @pyd.field_validator('mapping', mode='before')
     @classmethod
-    def flatten_message_nodes(cls, mapping: dict) -> Any:
+    @profiled
+    def flatten_message_nodes(cls, mapping: dict, info: pyd.ValidationInfo) -> Any:
+        if is_normalized(info):
+            return mapping
+
         assert mapping
         first_node = next(iter(mapping.values()))
 
@@ -59,36 +76,106 @@ class Conversation(Model):
             # Already flattened
             return mapping
 
-        def flatten_message_node(node: dict) -> dict:
-            msg = node.pop('message')
-            if msg is None:
-                node['role'] = 'root'
-                return node
-
-            msg['id'] = node['id']
-            msg['parent'] = node['parent']
-            msg['children'] = node['children']
-
-            # Flatten author
-            assert 'role' not in msg
-            assert 'name' not in msg
-            assert 'author_metadata' not in msg
-            author = msg.pop('author')
-            assert author
-            msg['role'] = author['role']
-            msg['name'] = author['name']
-            msg['author_metadata'] = author['metadata']
-            return msg
-
         return {
             k: flatten_message_node(v) for k, v in mapping.items()
         }
 
+    def tree(self) -> TreeIndex:
+        """
+        The index of `mapping`, built on first use. Rebuilt if `mapping` is replaced,
+        but not if it's modified in place.
+        """
+        if self._tree is None or self._tree_mapping is not self.mapping:
+            self._tree = TreeIndex(self.mapping)
+            self._tree_mapping = self.mapping
+            self._active_path = None
+        return self._tree
+
+    def active_path(self) -> list[Message]:
+        """
+        The messages of the branch shown in the ChatGPT UI, from the first message
+        down to `current_node`. Cached like `tree()`.
+        """
+        tree = self.tree()
+        if self._active_path is None:
+            nodes = (self.mapping[id] for id in tree.path_to(self.current_node))
+            # Skipping the root node, which is always first
+            self._active_path = [n for n in nodes if not isinstance(n, RootNode)]
+        return self._active_path
+
     def get_root_node(self) -> RootNode:
-        for node in self.mapping.values():
-            if node.parent is None and node.role == 'root':
-                return node
-        raise ValueError("No root node found in the conversation mapping.")
+        root = self.mapping[self.tree().root]
+        if not isinstance(root, RootNode):
+            raise ValueError("No root node found in the conversation mapping.")
+        return root
+
+
+# Validation context key. Pass `context={NORMALIZED: True}` when validating the output
+# of `normalize_conversation`, so the before-validators don't redo its work.
+NORMALIZED = 'normalized'
+
+
+def is_normalized(info: pyd.ValidationInfo) -> bool:
+    return bool(info.context and info.context.get(NORMALIZED))
+
+
+def flatten_message_node(node: dict) -> dict:
+    msg = node.pop('message')
+    if msg is None:
+        node['role'] = 'root'
+        return node
+
+    msg['id'] = node['id']
+    msg['parent'] = node['parent']
+    msg['children'] = node['children']
+
+    # Flatten author
+    assert 'role' not in msg
+    assert 'name' not in msg
+    assert 'author_metadata' not in msg
+    author = msg.pop('author')
+    assert author
+    msg['role'] = author['role']
+    msg['name'] = author['name']
+    msg['author_metadata'] = author['metadata']
+    return msg
+
+
+def normalize_conversation(
+    obj: dict, transform_str: Callable[[str], str] | None = None
+) -> dict:
+    """
+    Does the work of the `Conversation` before-validators (nullifying empty dicts and
+    flattening message nodes) in a single walk over a raw conversation, optionally
+    applying `transform_str` to every string, including keys (e.g. to shorten UUIDs).
+
+    Returns a new dict, and leaves `obj` untouched.
+    """
+
+    def normalize(value: Any) -> Any:
+        if type(value) is dict:
+            if not value:
+                return None
+            return {normalize(k): normalize(v) for k, v in value.items()}
+        if type(value) is list:
+            return [normalize(item) for item in value]
+        if transform_str is not None and type(value) is str:
+            return transform_str(value)
+        return value
+
+    result: dict = {}
+    for key, value in obj.items():
+        if key == 'mapping' and type(value) is dict and value:
+            # The nodes are freshly built by `normalize`, so they can be flattened in
+            # place without another copy.
+            value = {
+                normalize(k): flatten_message_node(normalize(v))
+                for k, v in value.items()
+            }
+        else:
+            value = normalize(value)
+        result[normalize(key)] = value
+    return result
 
 
 def nullify_empty_dicts_rec(obj: Any) -> Any:
@@ -2,6 +2,7 @@ from __future__ import annotations
 import pydantic as pyd
 from typing import Literal as Lit, Any
 from .config import Model, ModelName
+from .profiling import profiled
 from .tool import Canvas
 
 class SystemMessage(Model):
@@ -34,6 +35,7 @@ class Content(Model):
 
     @pyd.model_validator(mode='before')
     @classmethod
+    @profiled
     def convert_parts(cls, obj: Any) -> Any:
         if isinstance(obj, dict) and isinstance(obj.get('parts'), list):
             assert len(obj['parts']) == 1
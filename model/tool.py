@@ -2,6 +2,7 @@ from __future__ import annotations
 from typing import Any, Literal as Lit, Annotated
 import pydantic as pyd
 from .config import Model, DefaultToolName, ModelName, PluginName
+from .profiling import profiled
 
 
 class ToolMessage(Model):
@@ -39,6 +40,7 @@ class TextContent(Model):
 
     @pyd.model_validator(mode='before')
     @classmethod
+    @profiled
     def convert_parts(cls, obj: Any) -> Any:
         if isinstance(obj, dict) and isinstance(obj.get('parts'), list):
             if len(obj['parts']) == 1:
@@ -100,6 +102,7 @@ class MultimodalTextContent(Model):
 
     @pyd.field_validator('parts', mode='before')
     @classmethod
+    @profiled
     def convert_text_parts(cls, parts: list) -> list:
         if any([isinstance(part, str) for part in parts]):
             # Convert string parts to TextContentPart
@@ -0,0 +1,103 @@
+"""
+A compact index of the tree of nodes in `Conversation.mapping`.
+"""
+
+from __future__ import annotations
+from collections.abc import Mapping, Sequence
+from typing import Protocol
+
+
+class TreeNode(Protocol):
+    # Read-only, so nodes with narrower types (like a `Literal` role) match
+    @property
+    def id(self) -> str: ...
+    @property
+    def parent(self) -> str | None: ...
+    @property
+    def children(self) -> list[str]: ...
+    @property
+    def role(self) -> str: ...
+
+
+class TreeIndex:
+    """
+    Built once per conversation, without recursion, so very long conversations don't
+    hit the recursion limit.
+
+    Each node gets an integer id, which is its position in a pre-order (depth-first)
+    walk from the root. So the root is always `0`, and the subtree of node `i` is
+    exactly `range(i, i + size[i])`, which makes ancestor checks O(1) and subtree
+    iteration O(subtree).
+
+    Nodes that can't be reached from the root aren't indexed, so check
+    `len(index) == len(mapping)` where that matters.
+    """
+
+    __slots__ = ('ids', 'index', 'parent', 'children', 'depth', 'size')
+
+    def __init__(self, mapping: Mapping[str, TreeNode]):
+        root = find_root(mapping)
+        # Node id of each integer id, in pre-order
+        self.ids: list[str] = []
+        # Integer id of each node id
+        self.index: dict[str, int] = {}
+        # Integer id of each node's parent, or -1 for the root
+        self.parent: list[int] = []
+        self.children: list[list[int]] = []
+        self.depth: list[int] = []
+        # Number of nodes in each node's subtree, including itself
+        self.size: list[int] = []
+
+        stack: list[tuple[str, int]] = [(root.id, -1)]
+        while stack:
+            node_id, parent = stack.pop()
+            i = len(self.ids)
+            self.ids.append(node_id)
+            self.index[node_id] = i
+            self.parent.append(parent)
+            self.children.append([])
+            self.depth.append(self.depth[parent] + 1 if parent >= 0 else 0)
+            self.size.append(1)
+            if parent >= 0:
+                self.children[parent].append(i)
+            # Reversed, so children are visited in their original order
+            stack.extend((child, i) for child in reversed(mapping[node_id].children))
+
+        # Children always come after their parent in pre-order, so one reverse pass
+        # sums every subtree.
+        for i in range(len(self.ids) - 1, 0, -1):
+            self.size[self.parent[i]] += self.size[i]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def root(self) -> str:
+        return self.ids[0]
+
+    def is_ancestor(self, ancestor: str, node: str) -> bool:
+        "Whether `ancestor` is `node` or one of its ancestors"
+        a, n = self.index[ancestor], self.index[node]
+        return a <= n < a + self.size[a]
+
+    def subtree(self, node: str) -> Sequence[str]:
+        "`node` and all its descendants, in pre-order"
+        i = self.index[node]
+        return self.ids[i : i + self.size[i]]
+
+    def path_to(self, node: str) -> list[str]:
+        "The node ids from the root down to `node`"
+        path: list[str] = []
+        i = self.index[node]
+        while i >= 0:
+            path.append(self.ids[i])
+            i = self.parent[i]
+        path.reverse()
+        return path
+
+
+def find_root(mapping: Mapping[str, TreeNode]) -> TreeNode:
+    for node in mapping.values():
+        if node.parent is None and node.role == 'root':
+            return node
+    raise ValueError('No root node found in the conversation mapping.')
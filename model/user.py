@@ -2,6 +2,7 @@ from __future__ import annotations
 import pydantic as pyd
 from typing import Any, Literal as Lit, Annotated
 from .config import Model
+from .profiling import profiled
 from .tool import Canvas
 
 
@@ -39,6 +40,7 @@ class TextContent(Model):
 
     @pyd.model_validator(mode='before')
     @classmethod
+    @profiled
     def convert_parts(cls, obj: Any) -> Any:
         if isinstance(obj, dict) and isinstance(obj.get('parts'), list):
             assert len(obj['parts']) == 1
@@ -52,6 +54,7 @@ class MultimodalTextContent(Model):
 
     @pyd.field_validator('parts', mode='before')
     @classmethod
+    @profiled
     def convert_text_parts(cls, parts: list) -> list:
         if any([isinstance(part, str) for part in parts]):
             # Convert string parts to TextContentPart
@@ -1,10 +1,11 @@
 from datetime import datetime
-import pickle
 import polars as pl
 from polars import col
 import polars.selectors as cs
-from model.conversation import Conversation, Message
+from model.conversation import Conversation
 from analyze_messages import get_all_messages
+from convo_store import ConvoStore
+from instrumentation import instrumented, stage
 
 pl.Config(
     set_tbl_cols=100,
@@ -32,60 +33,37 @@ run_convo_ids: list[str] = [
 active_path: bool = True
 
 
+@instrumented('analyze_conversation')
 def main():
-    with open('1-conversations-clean.pkl', 'rb') as f:
-        convos = pickle.load(f)
-
-    df_all_messages = get_all_messages()
-
-    convos_map = {c.id: c for c in convos}
-
-    outputs = [
-        analyze_convo(convos_map[convo_id], df_all_messages)
-        for convo_id in run_convo_ids
-    ]
+    with stage('analyze_convos') as s, ConvoStore() as store:
+        outputs = [analyze_convo(store.get(convo_id)) for convo_id in run_convo_ids]
+        s.records = len(outputs)
     result = '\n\n\n\n'.join(outputs)
     print(result)
 
 
-def analyze_convo(convo: Conversation, df_all_messages: pl.DataFrame) -> str:
-    messages: list[Message] = []
-    if not active_path:
-        for message in convo.mapping.values():
-            if message.role == 'root':
-                continue
-            messages.append(message)
-    else:
-        current_node: str | None = convo.current_node
-        while current_node:
-            message = convo.mapping[current_node]
-            current_node = message.parent
-            if message.role != 'root':
-                messages.insert(0, message)
-
-    # dumped = [m.model_dump(exclude={'metadata'}) for m in messages]
-    # print(json.dumps(dumped, indent=2))
-    # quit()
-
-    # dumped = [m.model_dump() for m in messages]
-    # for msg in dumped:
-    #     metadata = msg['metadata']
-    #     metadata.pop('content_references', None)
-    #     metadata.pop('citations', None)
-    #     metadata.pop('search_result_groups', None)
-    #     metadata.pop('image_results', None)
-    # print(json.dumps(dumped, indent=2))
-    # quit()
-    message_ids = [m.id for m in messages]
-
+def analyze_convo(convo: Conversation) -> str:
+    # Only this conversation's messages are read, and only the row groups that can
+    # hold them
     df = (
-        df_all_messages.filter(
+        get_all_messages(
             col('convo_id') == convo.id,
-            col('id').is_in(message_ids),
+            col('is_active_path') | pl.lit(not active_path),
             col('role') != 'system',
         )
         # .pipe(lambda df: print(df) or quit())
-        .drop('convo_id', 'id', 'children')
+        # With `PARTITION_MESSAGE_ROWS`, the rows are grouped by month and role, so
+        # they're put back in tree order
+        .sort(
+            col('id').replace_strict(
+                convo.tree().index, default=None, return_dtype=pl.Int64
+            ),
+            nulls_last=True,
+        )
+        .drop('convo_id', 'id', 'children', 'is_active_path', 'depth', 'turn_index')
+        # Enum columns can only hold their own categories, so the replacements below
+        # need plain strings
+        .with_columns(cs.by_dtype(pl.Enum).cast(pl.String))
         .with_columns(
             text=col('text').str.replace('\n', ' ', n=-1).str.replace(' +', ' ', n=-1),
             end_turn=col('end_turn').cast(str).replace('false', None),
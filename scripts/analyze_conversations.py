@@ -1,5 +1,6 @@
 import polars as pl
 from polars import col
+from instrumentation import instrumented, stage
 
 pl.Config(
     set_tbl_cols=100,
@@ -7,9 +8,14 @@ pl.Config(
 )
 
 
+@instrumented('analyze_conversations')
 def main():
+    with stage('read_parquet') as s:
+        df_convos = pl.read_parquet('2-conversations-clean-convo-rows.parquet')
+        s.records = len(df_convos)
+
     df = (
-        pl.read_parquet('2-conversations-clean-convo-rows.parquet')
+        df_convos
         .with_columns(
             create_time=pl.from_epoch('create_time'),
             update_time=pl.from_epoch('update_time'),
@@ -39,8 +45,12 @@ def main():
             'gizmo_id',
             'gizmo_type',
         )
+        # The tool ids are an Enum, which `list.join` doesn't take
         .with_columns(
-            col('disabled_tool_ids').list.join(',').replace('', None)
+            col('disabled_tool_ids')
+            .cast(pl.List(pl.String))
+            .list.join(',')
+            .replace('', None)
         )
         # Remove 3rd party plugin convos since there's so few, and they're old
         .filter(col('plugin_ids').is_null())
@@ -1,6 +1,11 @@
+import os
 import polars as pl
 from polars import col
-import polars.selectors as cs
+from column_stats import read_column_stats
+from extract_rows import MESSAGE_ROWS_DATASET, MESSAGE_ROWS_PATH, PARTITION_MESSAGE_ROWS
+from instrumentation import instrumented, stage
+from parquet_sink import scan_partitioned
+from row_schema import message_row_schema
 
 pl.Config(
     set_fmt_str_lengths=45,
@@ -9,125 +14,169 @@ pl.Config(
 )
 
 
+# The columns `get_all_messages` leaves out by default. Comment one out to load it.
+IGNORED_COLUMNS = {
+    # 'convo_id',
+    # 'id',
+    'parent',
+    # 'children',
+    # 'role',
+    # 'name',
+    'author_metadata',
+    # 'create_time',
+    'update_time',
+    # 'status',
+    # 'end_turn',
+    'weight',
+    # 'recipient',
+    'channel',
+    # 'content_type',
+    # 'text',
+    'reasoning_status',
+    'is_visually_hidden_from_conversation',
+    'is_complete',
+    'is_user_system_message',
+    'user_context_message_data',
+    'rebase_system_message',
+    'rebase_developer_message',
+    # 'model_slug',
+    'requested_model_slug',
+    'default_model_slug',
+    'parent_id',
+    'request_id',
+    'timestamp_',
+    'attachments',
+    # 'finish_details',
+    'pad',
+    'targeted_reply',
+    'selected_sources',
+    'selected_github_repos',
+    'serialization_metadata',
+    'paragen_variants_info',
+    'paragen_variant_choice',
+    'caterpillar_selected_sources',
+    'system_hints',
+    'message_locale',
+    'finished_duration_sec',
+    'search_source',
+    'client_reported_search_source',
+    'search_display_string',
+    'searched_display_string',
+    'filter_out_for_training',
+    'debug_sonic_thread_id',
+    'augmented_paragen_prompt_label',
+    'safe_urls',
+    'search_queries',
+    'sonic_classification_result',
+    # 'thoughts',
+    'source_analysis_msg_id',
+    'language',
+    'aggregate_result',
+    'cite_metadata',
+    'initial_text',
+    'finished_text',
+    'cloud_doc_urls',
+    'command',
+    'args',
+    'kwargs',
+    'invoked_plugin',
+    'ada_visualizations',
+    'canvas',
+    'parts',
+    'summary',
+    'assets',
+    'url',
+    'domain',
+    'title',
+    # Only in the partitioned dataset (see `parquet_sink.sink_partitioned`)
+    'month',
+}
+
+
+@instrumented('analyze_messages')
 def main():
-    df = (
-        get_all_messages()
-        .with_columns(
-            text=col('text').str.replace('\n', ' ', n=-1).str.slice(0, 40)
-        )
-        .filter(
+    with stage('get_all_messages') as s:
+        df_all_messages = get_all_messages(
             col('finish_details').struct.field('type') == 'interrupted',
             col('end_turn') == True,
             # col('role') == 'assistant',
             # col('status') == 'in_progress',
             # col('content_type') != 'thoughts',
         )
+        s.records = len(df_all_messages)
+
+    df = (
+        df_all_messages
+        .with_columns(
+            text=col('text').str.replace('\n', ' ', n=-1).str.slice(0, 40)
+        )
         # .head(50)
     )
     print(df)
 
 
-def get_all_messages() -> pl.DataFrame:
+def get_all_messages(
+    *predicates: pl.Expr, columns: list[str] | None = None
+) -> pl.DataFrame:
+    """
+    The message rows written by `extract_rows.py` that match all of `predicates`, with
+    only `columns` (by default, all but `IGNORED_COLUMNS`), minus those that are null
+    in every message row.
 
-    df = (
-        pl.read_parquet('2-conversations-clean-message-rows.parquet')
-        .with_columns(
-            create_time=pl.from_epoch('create_time'),
-            update_time=pl.from_epoch('update_time'),
-        )
-        .pipe(remove_boring_columns)
-        .drop(
-            # 'convo_id',
-            # 'id',
-            'parent',
-            # 'children',
-            # 'role',
-            # 'name',
-            'author_metadata',
-            # 'create_time',
-            'update_time',
-            # 'status',
-            # 'end_turn',
-            'weight',
-            # 'recipient',
-            'channel',
-            # 'content_type',
-            # 'text',
-            'reasoning_status',
-            'is_visually_hidden_from_conversation',
-            'is_complete',
-            'is_user_system_message',
-            'user_context_message_data',
-            'rebase_system_message',
-            'rebase_developer_message',
-            # 'model_slug',
-            'requested_model_slug',
-            'default_model_slug',
-            'parent_id',
-            'request_id',
-            'timestamp_',
-            'attachments',
-            # 'finish_details',
-            'pad',
-            'targeted_reply',
-            'selected_sources',
-            'selected_github_repos',
-            'serialization_metadata',
-            'paragen_variants_info',
-            'paragen_variant_choice',
-            'caterpillar_selected_sources',
-            'system_hints',
-            'message_locale',
-            'finished_duration_sec',
-            'search_source',
-            'client_reported_search_source',
-            'search_display_string',
-            'searched_display_string',
-            'filter_out_for_training',
-            'debug_sonic_thread_id',
-            'augmented_paragen_prompt_label',
-            'safe_urls',
-            'search_queries',
-            'sonic_classification_result',
-            # 'thoughts',
-            'source_analysis_msg_id',
-            'language',
-            'aggregate_result',
-            'cite_metadata',
-            'initial_text',
-            'finished_text',
-            'cloud_doc_urls',
-            'command',
-            'args',
-            'kwargs',
-            'invoked_plugin',
-            'ada_visualizations',
-            'canvas',
-            'parts',
-            'summary',
-            'assets',
-            'url',
-            'domain',
-            'title',
-        )
-    )
-    return df
+    Only `columns`, and the columns used by `predicates`, are read from disk, and the
+    predicates are checked against the parquet statistics first, to skip the row
+    groups (and with `PARTITION_MESSAGE_ROWS`, the files) that can't match. Predicates
+    see the stored values, so `create_time` is still seconds since the epoch.
 
+    With `PARTITION_MESSAGE_ROWS`, the rows of a conversation are grouped by month and
+    role, instead of being in tree order.
+    """
+    path = message_rows_path()
+    lf = scan_message_rows(path)
+    schema = lf.collect_schema()
+    boring = set(get_null_columns(lf, path))
+    if columns is None:
+        columns = [name for name in schema if name not in IGNORED_COLUMNS]
+    if predicates:
+        lf = lf.filter(*predicates)
+    selected = [name for name in columns if name in schema and name not in boring]
+    lf = lf.select(selected)
+    # Unless it wasn't asked for, or is null in every row
+    if 'create_time' in selected:
+        lf = lf.with_columns(create_time=pl.from_epoch('create_time'))
+    return lf.collect()
 
-def remove_boring_columns(df: pl.DataFrame) -> pl.DataFrame:
-    boring = (
-        df.select(
-            cs.string(include_categorical=True),
-            cs.numeric(),
-            cs.temporal(),
-            cs.by_dtype(pl.Null, pl.Boolean),
-        )
-        .select(pl.all().cast(str).unique().count())
-        .transpose(include_header=True)
-        .filter(col('column_0') == 0)
-    )
-    names = boring['column'].to_list()
-    return df.drop(names)
+
+def message_rows_path() -> str:
+    "The dataset written by `extract_rows.py` if there is one, else the file"
+    if PARTITION_MESSAGE_ROWS and os.path.isdir(MESSAGE_ROWS_DATASET):
+        return MESSAGE_ROWS_DATASET
+    return MESSAGE_ROWS_PATH
+
+
+def scan_message_rows(path: str) -> pl.LazyFrame:
+    if os.path.isdir(path):
+        return scan_partitioned(path, message_row_schema().schema)
+    return pl.scan_parquet(path)
+
+
+def get_null_columns(lf: pl.LazyFrame, path: str) -> list[str]:
+    """
+    The columns of `lf`, scanned from `path`, that are null in every row. Taken from
+    the statistics `extract_rows.py` writes next to the rows, so no data is read,
+    unless they're missing.
+    """
+    stats = read_column_stats(path)
+    if stats is not None:
+        return stats.null_columns()
+    # Rows written before statistics were recorded. With an explicit schema (see
+    # `row_schema.py`), null columns keep their type instead of being inferred as
+    # `Null`, so they're found by their null count, whatever the type.
+    num_rows = lf.select(pl.len()).collect().item()
+    null_counts = lf.select(pl.all().null_count()).collect().row(0, named=True)
+    return [
+        name for name, count in null_counts.items() if num_rows and count == num_rows
+    ]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,297 @@
+"""
+Benchmarks each stage of the pipeline on a fixed synthetic export (see
+`generate_export.py`), and compares the results to a stored baseline.
+
+Each stage runs in a fresh process, which first prepares the stage's inputs (untimed),
+then times the stage itself. For each stage, this records throughput in records/s,
+and the peak RSS of that process while the stage ran (which includes its inputs).
+Timings vary between processes, so every stage is run in `ROUNDS` processes, and the
+best of them is kept.
+
+Results are compared against `BASELINE_PATH`, and any stage whose throughput dropped
+by more than `THROUGHPUT_THRESHOLD`, or whose peak RSS grew by more than
+`REGRESSION_THRESHOLD`, is flagged, and the script exits with status 1. Stages that take less than `MIN_COMPARED_SECONDS` are too short
+for their throughput to be compared reliably, so only their memory is. Set `UPDATE_BASELINE` to save the results as the new baseline,
+e.g. after an intended change to the models or scripts.
+"""
+
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from pydantic import BaseModel
+from model.conversation import Conversation, NORMALIZED
+from analyze_messages import get_all_messages
+from convo_store import STORE_PATH, ConvoStore, write_convos
+from message_columns import iter_message_batches, message_dataframe
+from parquet_sink import sink_batches
+from row_schema import message_row_schema
+from instrumentation import peak_rss_mb, reset_peak_rss
+from generate_export import GeneratorConfig, generate_conversations, write_export
+from parse_validate_clean import (
+    UUID_LAST_CHARS,
+    VALIDATE_CONTENT_BY_TYPE,
+    iter_json_array,
+    normalize_convos,
+    shorten_all_uuids,
+    sort_mapping,
+    validate_model,
+)
+from validation_cache import model_fingerprint
+
+BASELINE_PATH = 'benchmark-baseline.json'
+# Where the synthetic export and every stage's output are written
+WORK_DIR = 'benchmark-data'
+# A stage regresses if it uses this much more memory than the baseline
+REGRESSION_THRESHOLD = 0.1
+# Or if its throughput drops by this much. Wider, since even the best of `ROUNDS` runs
+# varied by up to 15% between benchmarks of an identical tree, while peak RSS didn't
+THROUGHPUT_THRESHOLD = 0.2
+# Each stage is run this many times, each in a fresh process, and the best is kept
+ROUNDS = 5
+# Throughput isn't compared for stages faster than this in the baseline, since timer
+# and scheduling noise is a large part of their time
+MIN_COMPARED_SECONDS = 0.5
+UPDATE_BASELINE = False
+
+CONFIG = GeneratorConfig(seed=0, num_convos=500)
+
+EXPORT_PATH = 'conversations.json'
+MESSAGE_ROWS_PATH = '2-conversations-clean-message-rows.parquet'
+
+
+class StageResult(BaseModel):
+    # Of the fastest of `runs` runs
+    seconds: float
+    runs: int = 1
+    records: int
+    records_per_s: float
+    peak_rss_mb: float
+
+
+class Benchmark(BaseModel):
+    config: GeneratorConfig
+    model_fingerprint: str
+    stages: dict[str, StageResult]
+
+
+def main():
+    os.makedirs(WORK_DIR, exist_ok=True)
+    write_export(os.path.join(WORK_DIR, EXPORT_PATH), generate_conversations(CONFIG))
+
+    # A fresh interpreter per stage, so peak RSS only reflects that stage. Rounds run
+    # every stage in order, since later stages read the files of earlier ones.
+    ctx = multiprocessing.get_context('spawn')
+    runs: dict[str, list[StageResult]] = {name: [] for name in STAGES}
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for _ in range(ROUNDS):
+            for name in STAGES:
+                try:
+                    runs[name].append(pool.apply(run_stage, (name, WORK_DIR)))
+                except Exception as e:
+                    print(f'{name:<22} failed: {e!r}')
+                    sys.exit(1)
+    stages = {name: best_run(stage_runs) for name, stage_runs in runs.items()}
+    for name, stage in stages.items():
+        print(format_result(name, stage))
+
+    result = Benchmark(
+        config=CONFIG,
+        model_fingerprint=model_fingerprint(UUID_LAST_CHARS),
+        stages=stages,
+    )
+
+    if UPDATE_BASELINE or not os.path.exists(BASELINE_PATH):
+        Path(BASELINE_PATH).write_text(result.model_dump_json(indent=2))
+        print(f'\nSaved baseline to {BASELINE_PATH}')
+        return
+
+    baseline = Benchmark.model_validate_json(Path(BASELINE_PATH).read_text())
+    regressions = find_regressions(
+        baseline, result, THROUGHPUT_THRESHOLD, REGRESSION_THRESHOLD
+    )
+    if baseline.config != result.config:
+        print('\nThe baseline was recorded with a different config')
+    if baseline.model_fingerprint != result.model_fingerprint:
+        print('\nThe models have changed since the baseline was recorded')
+    if regressions:
+        print('\nRegressions:\n' + '\n'.join(regressions))
+        sys.exit(1)
+    print(
+        f'\nNo regressions beyond {THROUGHPUT_THRESHOLD:.0%} throughput'
+        f' or {REGRESSION_THRESHOLD:.0%} peak RSS'
+    )
+
+
+def find_regressions(
+    baseline: Benchmark,
+    result: Benchmark,
+    throughput_threshold: float,
+    memory_threshold: float,
+) -> list[str]:
+    regressions: list[str] = []
+    for name, stage in result.stages.items():
+        base = baseline.stages.get(name)
+        if base is None:
+            continue
+        if base.seconds >= MIN_COMPARED_SECONDS and stage.records_per_s < (
+            base.records_per_s * (1 - throughput_threshold)
+        ):
+            regressions.append(
+                f'{name}: {stage.records_per_s:,.1f} records/s'
+                f' (baseline {base.records_per_s:,.1f})'
+            )
+        if stage.peak_rss_mb > base.peak_rss_mb * (1 + memory_threshold):
+            regressions.append(
+                f'{name}: {stage.peak_rss_mb:,.1f} MB peak RSS'
+                f' (baseline {base.peak_rss_mb:,.1f})'
+            )
+    return regressions
+
+
+def format_result(name: str, result: StageResult) -> str:
+    return (
+        f'{name:<22} {result.records:>9} records  {result.seconds:8.3f}s'
+        f'  {result.records_per_s:>12,.1f} records/s  {result.peak_rss_mb:8.1f} MB'
+    )
+
+
+def best_run(runs: list[StageResult]) -> StageResult:
+    "The fastest of `runs`, with the lowest peak RSS of any of them"
+    fastest = min(runs, key=lambda r: r.seconds)
+    return fastest.model_copy(
+        update={
+            'runs': len(runs),
+            'peak_rss_mb': min(r.peak_rss_mb for r in runs),
+        }
+    )
+
+
+def run_stage(name: str, work_dir: str) -> StageResult:
+    "Runs in a fresh process. Prepares the stage's inputs, then times the stage."
+    os.chdir(work_dir)
+    # Scripts `quit()` on invalid data, which would kill the pool's worker without
+    # returning, and leave `main` waiting for a result forever
+    try:
+        stage = STAGES[name]()
+        # Like `timeit`, so a collection of garbage left by preparing isn't timed
+        gc.collect()
+        gc.disable()
+        reset_peak_rss()
+        start = time.perf_counter()
+        records = stage()
+        seconds = time.perf_counter() - start
+        gc.enable()
+    except SystemExit as e:
+        raise RuntimeError(f'{name} exited with status {e.code}') from None
+    return StageResult(
+        seconds=seconds,
+        records=records,
+        records_per_s=records / seconds if seconds else 0.0,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+# Each stage prepares its inputs, and returns a function that runs the stage and
+# returns the number of records it processed.
+
+
+def stage_json_load() -> Callable[[], int]:
+    def run() -> int:
+        with open(EXPORT_PATH, 'r') as f:
+            return len(json.load(f))
+
+    return run
+
+
+def stage_iter_json_array() -> Callable[[], int]:
+    return lambda: sum(1 for _ in iter_json_array(EXPORT_PATH))
+
+
+def stage_shorten_all_uuids() -> Callable[[], int]:
+    raw_convos = list(iter_json_array(EXPORT_PATH))
+    return lambda: len(
+        [shorten_all_uuids(c, last_chars=UUID_LAST_CHARS) for c in raw_convos]
+    )
+
+
+def stage_normalize_convos() -> Callable[[], int]:
+    raw_convos = list(iter_json_array(EXPORT_PATH))
+    return lambda: len(list(normalize_convos(raw_convos, UUID_LAST_CHARS)))
+
+
+def validated_convos() -> list[Conversation]:
+    raw_convos = normalize_convos(iter_json_array(EXPORT_PATH), UUID_LAST_CHARS)
+    return validate_convos(raw_convos)
+
+
+def validate_convos(raw_convos: Iterable[dict]) -> list[Conversation]:
+    "Validates normalized conversations the way `parse_validate_clean.py` does"
+    return validate_model(
+        Conversation,
+        raw_convos,
+        context={NORMALIZED: True},
+        bucketed=VALIDATE_CONTENT_BY_TYPE,
+    )
+
+
+def stage_validate_model() -> Callable[[], int]:
+    raw_convos = list(normalize_convos(iter_json_array(EXPORT_PATH), UUID_LAST_CHARS))
+    return lambda: len(validate_convos(raw_convos))
+
+
+def stage_sort_mapping() -> Callable[[], int]:
+    convos = validated_convos()
+
+    def run() -> int:
+        for convo in convos:
+            sort_mapping(convo)
+        return sum(len(c.mapping) for c in convos)
+
+    return run
+
+
+def stage_write_convos() -> Callable[[], int]:
+    convos = validated_convos()
+    for convo in convos:
+        sort_mapping(convo)
+    return lambda: write_convos(convos, STORE_PATH)
+
+
+def stage_message_dataframe() -> Callable[[], int]:
+    with ConvoStore() as store:
+        convos = list(store)
+    return lambda: len(message_dataframe(convos))
+
+
+def stage_write_parquet() -> Callable[[], int]:
+    with ConvoStore() as store:
+        batches = list(iter_message_batches(store))
+    return lambda: sink_batches(batches, message_row_schema().schema, MESSAGE_ROWS_PATH)
+
+
+def stage_get_all_messages() -> Callable[[], int]:
+    return lambda: len(get_all_messages())
+
+
+# In run order. Later stages read the files written by earlier ones.
+STAGES: dict[str, Callable[[], Callable[[], int]]] = {
+    'json_load': stage_json_load,
+    'iter_json_array': stage_iter_json_array,
+    'shorten_all_uuids': stage_shorten_all_uuids,
+    'normalize_convos': stage_normalize_convos,
+    'validate_model': stage_validate_model,
+    'sort_mapping': stage_sort_mapping,
+    'write_convos': stage_write_convos,
+    'message_dataframe': stage_message_dataframe,
+    'write_parquet': stage_write_parquet,
+    'get_all_messages': stage_get_all_messages,
+}
+
+
+if __name__ == '__main__':
+    main()
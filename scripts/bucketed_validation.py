@@ -0,0 +1,135 @@
+"""
+Two-phase validation of normalized conversations (see `normalize_conversation`).
+
+Validating `Conversation` directly means that every message's `content` goes through
+a union dispatch, and an error deep inside a big union like `tool.Content` is hard to
+read. Instead, this first splits the `content` of every message in a batch of
+conversations into buckets by role and `content_type`, and validates each bucket in
+one call against its concrete model (`tool.BrowserDisplayContent`,
+`assistant.ThoughtsContent`, ...). The validated content models are put back in
+place, and since pydantic doesn't revalidate model instances, validating the
+conversation shells afterwards only checks everything else.
+"""
+
+from collections import defaultdict
+from functools import cache
+from types import UnionType
+from typing import Annotated, Any, TypeAliasType, Union, get_args, get_origin
+import pydantic
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import InitErrorDetails
+from model.conversation import Message
+
+
+def validate_chunk_bucketed[T: BaseModel](
+    model: type[T],
+    context: dict[str, Any] | None,
+    chunk: tuple[dict, ...],
+) -> tuple[list[T], tuple[int, str] | None]:
+    """
+    Same contract as `validate_chunk`: returns the models validated before the first
+    failure, and that failure's offset within `chunk` and error message.
+
+    The `content` of each message in `chunk` is replaced by its validated model.
+    """
+    models = content_models()
+
+    # Phase 1: validate contents in bulk, one bucket per (role, content_type)
+    buckets: dict[tuple[str, str], list[tuple[int, dict]]] = defaultdict(list)
+    for offset, doc in enumerate(chunk):
+        for node in doc['mapping'].values():
+            content = node.get('content')
+            if type(content) is dict:
+                # A missing `content_type` is left for phase 2 to report
+                key = (node['role'], str(content.get('content_type')))
+                if key in models:
+                    buckets[key].append((offset, node))
+
+    first_failure: tuple[int, str] | None = None
+    for key, items in buckets.items():
+        adapter = bucket_adapter(models[key])
+        try:
+            contents = adapter.validate_python(
+                [node['content'] for _, node in items], context=context
+            )
+        except pydantic.ValidationError as e:
+            # Report the earliest conversation with an invalid content in this bucket
+            offset = min(items[int(err['loc'][0])][0] for err in e.errors())
+            if first_failure is None or offset < first_failure[0]:
+                err = bucket_error(model, e, items, offset)
+                first_failure = (offset, str(err))
+            continue
+        for (_, node), content in zip(items, contents):
+            node['content'] = content
+
+    # Phase 2: validate the conversations themselves
+    validated: list[T] = []
+    for offset, doc in enumerate(chunk):
+        if first_failure is not None and offset == first_failure[0]:
+            break
+        try:
+            validated.append(model.model_validate(doc, context=context))
+        except pydantic.ValidationError as e:
+            return validated, (offset, str(e))
+
+    return validated, first_failure
+
+
+def bucket_error(
+    model: type[BaseModel],
+    e: pydantic.ValidationError,
+    items: list[tuple[int, dict]],
+    offset: int,
+) -> pydantic.ValidationError:
+    """
+    The errors of a bucket that are in the conversation at `offset`, located within
+    that conversation (`mapping.<node id>.content...`) instead of within the bucket.
+    """
+    errors: list[InitErrorDetails] = []
+    for err in e.errors():
+        index, *loc = err['loc']
+        item_offset, node = items[int(index)]
+        if item_offset != offset:
+            continue
+        details: InitErrorDetails = {
+            'type': err['type'],
+            'loc': ('mapping', node['id'], 'content', *loc),
+            'input': err['input'],
+        }
+        if 'ctx' in err:
+            details['ctx'] = err['ctx']
+        errors.append(details)
+    return pydantic.ValidationError.from_exception_data(model.__name__, errors)
+
+
+@cache
+def content_models() -> dict[tuple[str, str], type[BaseModel]]:
+    "The concrete content model for each (role, content_type) pair"
+    models: dict[tuple[str, str], type[BaseModel]] = {}
+    for message_model in union_members(Message):
+        (role,) = literal_values(message_model, 'role')
+        content = message_model.model_fields['content'].annotation
+        for content_model in union_members(content):
+            for content_type in literal_values(content_model, 'content_type'):
+                models[(role, content_type)] = content_model
+    return models
+
+
+@cache
+def bucket_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def union_members(annotation: Any) -> list[type[BaseModel]]:
+    "The models in an annotation like `type Content = Annotated[A | B, Discriminator]`"
+    if isinstance(annotation, TypeAliasType):
+        annotation = annotation.__value__
+    if get_origin(annotation) is Annotated:
+        annotation = get_args(annotation)[0]
+    if get_origin(annotation) in (Union, UnionType):
+        return [m for arg in get_args(annotation) for m in union_members(arg)]
+    return [annotation]
+
+
+def literal_values(model: type[BaseModel], field: str) -> tuple[str, ...]:
+    return get_args(model.model_fields[field].annotation)
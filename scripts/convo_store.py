@@ -0,0 +1,122 @@
+"""
+An on-disk store of validated `Conversation`s, written by `parse_validate_clean.py`.
+
+Each conversation is pickled separately, followed by an index of byte offsets keyed
+by conversation id. That way, a single conversation can be loaded without
+deserializing the rest of the export, and all conversations can be iterated lazily,
+one at a time.
+
+File layout:
+
+    MAGIC
+    pickle(Conversation)      # one per conversation, in the order they were written
+    ...
+    pickle({id: (offset, length)})
+    offset of the index       # 8 bytes, little endian
+"""
+
+import os
+import pickle
+import struct
+from collections.abc import Iterable, Iterator
+from types import TracebackType
+from typing import BinaryIO, Self
+from model.conversation import Conversation
+
+STORE_PATH = '1-conversations-clean.store'
+
+MAGIC = b'CONVOSTORE1\n'
+TRAILER = struct.Struct('<Q')
+
+
+def write_convos(convos: Iterable[Conversation], path: str = STORE_PATH) -> int:
+    """
+    Writes `convos` to a store at `path`, in iteration order, and returns how many
+    were written. Only one conversation is held in memory at a time.
+
+    The store is written to a temporary file next to `path`, which then replaces it,
+    so if writing is interrupted, the previous store at `path` is left intact.
+    """
+    index: dict[str, tuple[int, int]] = {}
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            for convo in convos:
+                assert convo.id not in index, f'Duplicate conversation id {convo.id}'
+                data = pickle.dumps(convo, protocol=pickle.HIGHEST_PROTOCOL)
+                index[convo.id] = (f.tell(), len(data))
+                f.write(data)
+
+            index_offset = f.tell()
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(TRAILER.pack(index_offset))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return len(index)
+
+
+class ConvoStore:
+    """
+    Read access to a store written by `write_convos`.
+
+        with ConvoStore() as store:
+            convo = store.get('0a5-462f5694886a')
+            for convo in store:
+                ...
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._file: BinaryIO = open(path, 'rb')
+        try:
+            self._index = self._read_index()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _read_index(self) -> dict[str, tuple[int, int]]:
+        f = self._file
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{self.path} is not a conversation store')
+        f.seek(-TRAILER.size, 2)
+        (index_offset,) = TRAILER.unpack(f.read(TRAILER.size))
+        f.seek(index_offset)
+        return pickle.load(f)
+
+    def ids(self) -> list[str]:
+        "Conversation ids, in the order they were written"
+        return list(self._index)
+
+    def get(self, convo_id: str) -> Conversation:
+        offset, length = self._index[convo_id]
+        self._file.seek(offset)
+        return pickle.loads(self._file.read(length))
+
+    def __contains__(self, convo_id: str) -> bool:
+        return convo_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __iter__(self) -> Iterator[Conversation]:
+        for convo_id in self._index:
+            yield self.get(convo_id)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
@@ -1,7 +1,39 @@
-import pickle
+from collections.abc import Iterable, Iterator
 import polars as pl
-from polars.dependencies import pickle
 from model.conversation import Conversation, Message
+from convo_store import ConvoStore
+from instrumentation import instrumented, stage
+from message_columns import iter_message_batches
+from parquet_sink import (
+    PartSink,
+    sink_batches,
+    sink_partitioned,
+    sink_rows,
+    scan_partitioned,
+)
+from row_schema import (
+    CHILD_ROW_MODELS,
+    child_row_schema,
+    convo_row_schema,
+    message_row_schema,
+)
+from token_counts import TokenCounter, load_encodings
+
+MESSAGE_ROWS_PATH = '2-conversations-clean-message-rows.parquet'
+# Write the message rows as a dataset partitioned by month and role (see
+# `parquet_sink.sink_partitioned`) to this directory, instead of `MESSAGE_ROWS_PATH`
+PARTITION_MESSAGE_ROWS = False
+MESSAGE_ROWS_DATASET = '2-conversations-clean-message-rows'
+CONVO_ROWS_PATH = '2-conversations-clean-convo-rows.parquet'
+# Fill `token_count` and `context_tokens` (see `token_counts.py`). Needs the tiktoken
+# encodings, which are downloaded on first use. If they can't be, both are left null.
+COUNT_TOKENS = True
+# The tables of the metadata fields left out of the message rows, like
+# `2-conversations-clean-citations-rows.parquet`
+CHILD_ROWS_PATHS = {
+    field: f'2-conversations-clean-{field.replace("_", "-")}-rows.parquet'
+    for field in CHILD_ROW_MODELS
+}
 
 pl.Config(
     set_tbl_cols=8,
@@ -9,52 +41,59 @@ pl.Config(
 )
 
 
+@instrumented('extract_rows')
 def main():
-    with open('1-conversations-clean.pkl', 'rb') as f:
-        convos: list[Conversation] = pickle.load(f)
-
-    messages_rows = get_all_message_rows(convos)
-    messages_df = pl.DataFrame(messages_rows, infer_schema_length=None)
-    print(messages_df)
-    messages_df.write_parquet('2-conversations-clean-message-rows.parquet')
-
-    convos_rows = get_all_convo_rows(convos)
-    convos_df = pl.DataFrame(convos_rows, infer_schema_length=None)
-    print(convos_df)
-    convos_df.write_parquet('2-conversations-clean-convo-rows.parquet')
-
-
-def get_all_message_rows(convos: list[Conversation]) -> list[dict]:
-    rows: list[dict] = []
-    for convo in convos:
-        for message in convo.mapping.values():
-            if message.role == 'root':
-                continue
-            dumped = {
-                'convo_id': convo.id,
-                'id': message.id,
-                'parent': message.parent,
-                'children': message.children,
-                **message.model_dump(
-                    exclude={'id', 'parent', 'children', 'content', 'metadata'}
-                ),
-                **message.content.model_dump(),
-                **message.metadata.model_dump(
-                    exclude={
-                        'content_references',
-                        'citations',
-                        'search_result_groups',
-                        'image_results',
-                    }
-                ),
-            }
-            rows.append(dumped)
-
-    return rows
-
-
-def get_all_convo_rows(convos: list[Conversation]) -> list[dict]:
-    rows: list[dict] = []
+    # Each pass below streams conversations from disk, one at a time, and writes
+    # their rows out as it goes
+    with ConvoStore() as convos:
+        schema = message_row_schema().schema
+        # Filled in the same pass as the message rows
+        child_sinks = {
+            field: PartSink(path, child_row_schema(field).schema)
+            for field, path in CHILD_ROWS_PATHS.items()
+        }
+        token_counter = load_token_counter() if COUNT_TOKENS else None
+        message_batches = iter_message_batches(
+            convos, child_sinks=child_sinks, token_counter=token_counter
+        )
+        if PARTITION_MESSAGE_ROWS:
+            with stage('write_message_dataset') as s:
+                s.records = sink_partitioned(message_batches, MESSAGE_ROWS_DATASET)
+            print(f'Wrote {s.records} message rows to {MESSAGE_ROWS_DATASET}/')
+            print(scan_partitioned(MESSAGE_ROWS_DATASET, schema).head(10).collect())
+        else:
+            with stage('write_message_parquet') as s:
+                s.records = sink_batches(message_batches, schema, MESSAGE_ROWS_PATH)
+            print(f'Wrote {s.records} message rows to {MESSAGE_ROWS_PATH}')
+            print(pl.read_parquet(MESSAGE_ROWS_PATH, n_rows=10))
+
+        if token_counter is not None:
+            token_counter.save()
+
+        for field, sink in child_sinks.items():
+            with stage(f'write_{field}_parquet') as s:
+                s.records = sink.close()
+            print(f'Wrote {s.records} {field} rows to {sink.path}')
+
+        with stage('write_convo_parquet') as s:
+            s.records = sink_rows(
+                iter_convo_rows(convos), convo_row_schema(), CONVO_ROWS_PATH
+            )
+        print(f'Wrote {s.records} conversation rows to {CONVO_ROWS_PATH}')
+        print(pl.read_parquet(CONVO_ROWS_PATH, n_rows=10))
+
+
+def load_token_counter() -> TokenCounter | None:
+    "A `TokenCounter`, or None if the tiktoken encodings can't be loaded (e.g. offline)"
+    try:
+        load_encodings()
+    except OSError as e:
+        print(f'Not counting tokens, the tiktoken encodings could not be loaded: {e}')
+        return None
+    return TokenCounter.load()
+
+
+def iter_convo_rows(convos: Iterable[Conversation]) -> Iterator[dict]:
     for convo in convos:
         row = convo.model_dump(exclude={'mapping'})
         messages: list[Message] = [
@@ -85,9 +124,7 @@ def get_all_convo_rows(convos: list[Conversation]) -> list[dict]:
         row['tools_used'] = ','.join(sorted(tools_used)) or None
         row['content_types'] = ','.join(sorted(content_types)) or None
 
-        rows.append(row)
-
-    return rows
+        yield row
 
 
 if __name__ == '__main__':
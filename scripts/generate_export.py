@@ -0,0 +1,654 @@
+"""
+Generates a synthetic `conversations.json` for testing the pipeline at scale, without
+anyone's real export.
+
+The conversations follow the raw export format (unflattened nodes, full UUIDs, empty
+dicts, ...) and only use shapes that validate against the models in `model/`. Each
+turn is a user message followed by an assistant response, whose kind is picked from
+`content_mix`:
+
+- text: a plain text reply
+- thoughts: `thoughts` and `reasoning_recap`, then a text reply
+- code: `code` sent to python, its `execution_output`, then a text reply
+- tether_browsing_display: a search sent to browser, its results, then a text reply
+  that cites them
+- web_search: a search sent to web.run, its result groups, then a text reply with
+  content references, search result groups and image results
+- multimodal_text: the user message has an image and text, then a text reply
+- canmore, research, computer, n7jupd, image_gen: a call to that tool, and its
+  result with the tool's own metadata, then a text reply
+
+With probability `branch_prob`, a turn gets `branching_factor - 1` extra regenerated
+replies that end their own branch, like in the ChatGPT UI.
+
+The same config and seed always generate the same export.
+"""
+
+import json
+import random
+import uuid
+from collections.abc import Iterable, Iterator
+from typing import Any
+from pydantic import BaseModel
+
+OUTPUT_PATH = 'conversations-synthetic.json'
+
+
+class GeneratorConfig(BaseModel):
+    seed: int = 0
+    num_convos: int = 1000
+    # Turns per conversation are drawn uniformly from this range
+    turns: tuple[int, int] = (1, 12)
+    branching_factor: int = 2
+    branch_prob: float = 0.1
+    # Relative weight of each kind of turn
+    content_mix: dict[str, float] = {
+        'text': 5,
+        'thoughts': 2,
+        'code': 1,
+        'tether_browsing_display': 1,
+        'web_search': 1,
+        'multimodal_text': 1,
+        'canmore': 0.5,
+        'research': 0.25,
+        'computer': 0.25,
+        'n7jupd': 0.25,
+        'image_gen': 0.5,
+    }
+    # Words per text are drawn uniformly from this range
+    text_words: tuple[int, int] = (5, 300)
+    model_slugs: list[str] = ['gpt-4o', 'o3', 'gpt-4o-mini']
+    start_time: float = 1_700_000_000.0
+
+
+def main():
+    config = GeneratorConfig()
+    count = write_export(OUTPUT_PATH, generate_conversations(config))
+    print(f'Wrote {count} conversations to {OUTPUT_PATH}')
+
+
+def write_export(path: str, convos: Iterable[dict]) -> int:
+    "Writes `convos` as a JSON array, one conversation at a time"
+    count = 0
+    with open(path, 'w') as f:
+        f.write('[')
+        for convo in convos:
+            if count:
+                f.write(',\n')
+            json.dump(convo, f)
+            count += 1
+        f.write(']')
+    return count
+
+
+def generate_conversations(config: GeneratorConfig) -> Iterator[dict]:
+    rng = random.Random(config.seed)
+    for i in range(config.num_convos):
+        create_time = config.start_time + i * 3600 + rng.random() * 3600
+        yield ConvoBuilder(config, rng, create_time).build()
+
+
+# The tool called by each kind of turn that calls one, which is also the recipient of
+# the call. The result is built by the `<kind>_result` method of `ConvoBuilder`.
+TOOL_CALLS = {
+    'canmore': 'canmore.create_textdoc',
+    'research': 'research_kickoff_tool.start_research_task',
+    'computer': 'computer.initialize',
+    'n7jupd': 'n7jupd.metadata',
+    'image_gen': 'image_gen',
+}
+
+WORDS = (
+    'the of and to in is that for it as with was on be by this are from at or an '
+    'data model schema python export message tool search result value error type '
+    'function return list dict string number pydantic polars parquet conversation '
+    'assistant user system content metadata node parent child branch turn token '
+    'quickly carefully however because therefore example question answer check'
+).split()
+
+
+class ConvoBuilder:
+    def __init__(self, config: GeneratorConfig, rng: random.Random, create_time: float):
+        self.config = config
+        self.rng = rng
+        self.time = create_time
+        self.mapping: dict[str, dict] = {}
+        self.model_slug = rng.choice(config.model_slugs)
+        kinds = list(config.content_mix)
+        weights = [config.content_mix[k] for k in kinds]
+        self.pick_kind = lambda: rng.choices(kinds, weights)[0]
+
+    def build(self) -> dict:
+        convo_id = self.uuid()
+        create_time = self.time
+        root = self.add_node(None, None)
+        system = self.add_node(root, self.system_message())
+        current = system
+        for _ in range(self.rng.randint(*self.config.turns)):
+            user = self.add_turn(current)
+            current = self.add_response(user, self.pick_kind())
+            if self.rng.random() < self.config.branch_prob:
+                for _ in range(self.config.branching_factor - 1):
+                    self.add_response(user, self.pick_kind())
+
+        return {
+            'title': self.text(2, 6).capitalize(),
+            'create_time': create_time,
+            'update_time': self.time,
+            'mapping': self.mapping,
+            'moderation_results': [],
+            'current_node': current,
+            'plugin_ids': None,
+            'conversation_id': convo_id,
+            'conversation_template_id': None,
+            'gizmo_id': None,
+            'gizmo_type': None,
+            'is_archived': False,
+            'is_starred': None,
+            'safe_urls': [],
+            'blocked_urls': [],
+            'default_model_slug': self.model_slug,
+            'conversation_origin': None,
+            'voice': None,
+            'async_status': None,
+            'disabled_tool_ids': [],
+            'is_do_not_remember': False,
+            'memory_scope': 'global_enabled',
+            'sugar_item_id': None,
+            'sugar_item_visible': False,
+            'is_study_mode': False,
+            'id': convo_id,
+        }
+
+    def add_turn(self, parent: str) -> str:
+        if self.pick_kind() == 'multimodal_text':
+            content = {
+                'content_type': 'multimodal_text',
+                'parts': [self.image_part(), self.text()],
+            }
+        else:
+            content = {'content_type': 'text', 'parts': [self.text()]}
+        return self.add_node(parent, self.user_message(content))
+
+    def add_response(self, parent: str, kind: str) -> str:
+        "Adds the assistant (and tool) messages of a reply, and returns the last one"
+        reply_metadata: dict[str, Any] = {}
+        if kind == 'thoughts':
+            thoughts = [
+                {'summary': self.text(2, 6), 'content': self.text()}
+                for _ in range(self.rng.randint(1, 4))
+            ]
+            content = {
+                'content_type': 'thoughts',
+                'thoughts': thoughts,
+                'source_analysis_msg_id': self.uuid(),
+            }
+            parent = self.add_node(parent, self.assistant_message(content))
+            content = {
+                'content_type': 'reasoning_recap',
+                'content': f'Thought for {self.rng.randint(2, 90)} seconds',
+            }
+            parent = self.add_node(parent, self.assistant_message(content))
+        elif kind == 'code':
+            content = {
+                'content_type': 'code',
+                'language': 'unknown',
+                'text': self.code(),
+                'response_format_name': None,
+            }
+            parent = self.add_node(
+                parent, self.assistant_message(content, recipient='python')
+            )
+            content = {'content_type': 'execution_output', 'text': self.text()}
+            metadata = {
+                'is_complete': True,
+                'aggregate_result': {'status': 'success', 'code': self.code()},
+            }
+            if self.rng.random() < 0.3:
+                metadata['ada_visualizations'] = [
+                    {
+                        'type': 'table',
+                        'file_id': f'file-{self.rng.getrandbits(64):016x}',
+                        'title': self.text(2, 6),
+                    }
+                ]
+            parent = self.add_node(
+                parent, self.tool_message('python', content, metadata)
+            )
+        elif kind == 'tether_browsing_display':
+            query = self.text(2, 6)
+            content = {
+                'content_type': 'code',
+                'language': 'unknown',
+                'text': f'search({json.dumps(query)})',
+                'response_format_name': None,
+            }
+            parent = self.add_node(
+                parent, self.assistant_message(content, recipient='browser')
+            )
+            content = {
+                'content_type': 'tether_browsing_display',
+                'result': self.text(),
+                'summary': None,
+                'assets': None,
+                'tether_id': None,
+            }
+            metadata = {
+                '_cite_metadata': {
+                    'citation_format': {'name': 'tether_og'},
+                    'metadata_list': [],
+                },
+                'command': 'search',
+                'args': [query],
+                'status': 'finished',
+                'is_complete': True,
+            }
+            parent = self.add_node(
+                parent, self.tool_message('browser', content, metadata)
+            )
+            reply_metadata = {'citations': self.citations()}
+        elif kind == 'web_search':
+            parent, reply_metadata = self.add_web_search(parent)
+        elif kind in TOOL_CALLS:
+            name = TOOL_CALLS[kind]
+            content = {'content_type': 'text', 'parts': [self.text(2, 20)]}
+            parent = self.add_node(
+                parent, self.assistant_message(content, recipient=name)
+            )
+            content, metadata = getattr(self, f'{kind}_result')()
+            parent = self.add_node(parent, self.tool_message(name, content, metadata))
+
+        content = {'content_type': 'text', 'parts': [self.text()]}
+        return self.add_node(
+            parent,
+            self.assistant_message(content, end_turn=True, metadata=reply_metadata),
+        )
+
+    def add_web_search(self, parent: str) -> tuple[str, dict]:
+        "Adds a search and its results, and returns the metadata of the reply"
+        queries = [self.text(2, 6) for _ in range(self.rng.randint(1, 3))]
+        content = {
+            'content_type': 'code',
+            'language': 'unknown',
+            'text': json.dumps({'search_query': [{'q': q} for q in queries]}),
+            'response_format_name': None,
+        }
+        parent = self.add_node(
+            parent, self.assistant_message(content, recipient='web.run')
+        )
+        results = [self.search_result() for _ in range(self.rng.randint(1, 8))]
+        content = {'content_type': 'text', 'parts': ['']}
+        metadata = {
+            'search_result_groups': [
+                {
+                    'type': 'search_result_group',
+                    'domain': result['attribution'],
+                    'entries': [{**result, 'ref_id': None}],
+                }
+                for result in results
+            ],
+            'search_turns_count': 1,
+            'search_source': 'composer_search',
+            'client_reported_search_source': 'composer_search',
+            'status': 'finished',
+            'is_complete': True,
+        }
+        parent = self.add_node(parent, self.tool_message('web.run', content, metadata))
+
+        refs = [
+            {'ref_type': 'search', 'turn_index': 0, 'ref_index': i}
+            for i in range(len(results))
+        ]
+        content_references = [
+            {
+                'type': 'webpage',
+                'matched_text': f'\ue200cite\ue202turn0search{i}\ue201',
+                'start_idx': start,
+                'end_idx': start + 20,
+                'title': result['title'],
+                'url': result['url'],
+                'snippet': result['snippet'],
+                'attribution': result['attribution'],
+                'pub_date': result['pub_date'],
+                'refs': [ref],
+            }
+            for i, (result, ref, start) in enumerate(
+                zip(results, refs, sorted(self.rng.sample(range(2000), len(results))))
+            )
+        ]
+        content_references.append(
+            {
+                'type': 'sources_footnote',
+                'matched_text': ' ',
+                'start_idx': 2020,
+                'end_idx': 2020,
+                'sources': [
+                    {
+                        'title': result['title'],
+                        'url': result['url'],
+                        'attribution': result['attribution'],
+                    }
+                    for result in results
+                ],
+                'has_images': False,
+            }
+        )
+        return parent, {
+            'search_queries': [{'type': 'search', 'q': q} for q in queries],
+            'search_result_groups': [
+                {
+                    'type': 'search_result_group',
+                    'domain': result['attribution'],
+                    'entries': [{**result, 'ref_id': ref}],
+                }
+                for result, ref in zip(results, refs)
+            ],
+            'content_references': content_references,
+            'image_results': [
+                self.image_result() for _ in range(self.rng.choice([0, 0, 2, 4]))
+            ],
+            'search_source': 'composer_search',
+            'client_reported_search_source': 'composer_search',
+            'search_turns_count': 1,
+        }
+
+    def canmore_result(self) -> tuple[dict, dict]:
+        content = {
+            'content_type': 'text',
+            'parts': ['Successfully created text document'],
+        }
+        metadata = {
+            'canvas': {
+                'textdoc_id': f'{self.rng.getrandbits(96):024x}',
+                'textdoc_type': self.rng.choice(['document', 'code/python']),
+                'version': 1,
+                'title': self.text(2, 6),
+                'create_source': 'model',
+            },
+            'command': 'create_textdoc',
+        }
+        return content, metadata
+
+    def research_result(self) -> tuple[dict, dict]:
+        title = self.text(2, 8)
+        content = {'content_type': 'text', 'parts': [self.text(5, 20)]}
+        metadata = {
+            'async_task_title': title,
+            'async_task_prompt': self.text(20, 80),
+            'async_task_type': 'research',
+            'async_task_id': f'deepresch_{self.rng.getrandbits(64):016x}',
+            'async_task_conversation_id': self.uuid(),
+            'async_task_created_at': '2025-01-01 00:00:00.000000+00:00',
+            'deep_research_version': 'full',
+            'async_task_status_messages': {
+                'initial': 'Research started',
+                'completed_with_time': 'Research completed in {time}',
+                'completed_no_time': 'Completed research',
+                'error': 'Research failed',
+                'cancelled': 'Research cancelled',
+            },
+            'b1de6e2_s': True,
+            'command': 'start_research_task',
+        }
+        return content, metadata
+
+    def computer_result(self) -> tuple[dict, dict]:
+        content = {
+            'content_type': 'computer_output',
+            'computer_id': f'{self.rng.getrandbits(64):016x}',
+            'screenshot': None,
+            'tether_id': None,
+            'state': {
+                'type': 'computer_initialize_state',
+                'id': self.uuid(),
+                'os_type': 'computer',
+                'os_name': 'linux',
+                'os_version': '6.1',
+                'target_type': 'host',
+                'target_name': 'container',
+                'installed_software': ['python3', 'chromium'],
+            },
+            'is_ephemeral': None,
+        }
+        return content, {'source': 'computer', 'is_complete': True}
+
+    def n7jupd_result(self) -> tuple[dict, dict]:
+        title = self.text(2, 6)
+        url = f'https://example.com/{self.rng.choice(WORDS)}'
+        content = {'content_type': 'text', 'parts': [self.text()]}
+        metadata = {
+            'n7jupd_message': True,
+            'n7jupd_title': title,
+            'n7jupd_url': url,
+            'n7jupd_subtool': {
+                'generic_api_func': 'fetch',
+                'subtool': self.rng.choice(WORDS),
+                'used_internet': True,
+                'changed_url': False,
+                'result_of_subtool': None,
+            },
+            'n7jupd_v': {'application': 'Browser', 'title': title, 'url': url},
+        }
+        return content, metadata
+
+    def image_gen_result(self) -> tuple[dict, dict]:
+        title = self.text(2, 6)
+        gen_id = f'{self.rng.getrandbits(64):016x}'
+        part = self.image_part()
+        part['metadata'] = {
+            **part['metadata'],
+            'dalle': {
+                'gen_id': gen_id,
+                'prompt': '',
+                'seed': None,
+                'parent_gen_id': None,
+                'edit_op': None,
+                'serialization_title': 'DALL-E generation metadata',
+            },
+            'generation': {
+                'gen_id': gen_id,
+                'gen_size': 'xlimage',
+                'seed': None,
+                'parent_gen_id': None,
+                'height': part['height'],
+                'width': part['width'],
+                'transparent_background': False,
+                'serialization_title': 'Image Generation metadata',
+            },
+        }
+        content = {'content_type': 'multimodal_text', 'parts': [part]}
+        return content, {'image_gen_title': title}
+
+    def search_result(self) -> dict:
+        domain = f'{self.rng.choice(WORDS)}.example.com'
+        return {
+            'type': 'search_result',
+            'url': f'https://{domain}/{self.rng.choice(WORDS)}',
+            'title': self.text(3, 10),
+            'snippet': self.text(10, 40),
+            'pub_date': self.rng.choice([None, self.time - self.rng.uniform(0, 1e8)]),
+            'attribution': domain,
+        }
+
+    def image_result(self) -> dict:
+        url = f'https://{self.rng.choice(WORDS)}.example.com/{self.rng.getrandbits(32):08x}'
+        return {
+            'url': url,
+            'content_url': f'{url}.jpg',
+            'thumbnail_url': f'{url}-thumb.jpg',
+            'title': self.text(3, 10),
+            'content_size': {'width': 1200, 'height': 800},
+            'thumbnail_size': {'width': 300, 'height': 200},
+            'attribution': url.split('/')[2],
+        }
+
+    def citations(self) -> list[dict]:
+        "Citations of the results of a `tether_browsing_display` search"
+        citations = []
+        for i in range(self.rng.randint(1, 3)):
+            start = self.rng.randint(0, 2000)
+            citations.append(
+                {
+                    'start_ix': start,
+                    'end_ix': start + 12,
+                    'citation_format_type': 'tether_og',
+                    'metadata': {
+                        'type': 'webpage',
+                        'title': self.text(3, 10),
+                        'url': f'https://{self.rng.choice(WORDS)}.example.com',
+                        'text': self.text(10, 40),
+                        'pub_date': None,
+                        'extra': {
+                            'cited_message_idx': i,
+                            'search_result_idx': None,
+                            'evidence_text': 'source',
+                        },
+                    },
+                }
+            )
+        return citations
+
+    def add_node(self, parent: str | None, message: dict | None) -> str:
+        node_id = message['id'] if message else self.uuid()
+        self.mapping[node_id] = {
+            'id': node_id,
+            'message': message,
+            'parent': parent,
+            'children': [],
+        }
+        if parent is not None:
+            self.mapping[parent]['children'].append(node_id)
+        return node_id
+
+    def system_message(self) -> dict:
+        return {
+            'id': self.uuid(),
+            'author': {'role': 'system', 'name': None, 'metadata': {}},
+            'create_time': None,
+            'update_time': None,
+            'content': {'content_type': 'text', 'parts': ['']},
+            'status': 'finished_successfully',
+            'end_turn': True,
+            'weight': 0.0,
+            'metadata': {'is_visually_hidden_from_conversation': True},
+            'recipient': 'all',
+            'channel': None,
+        }
+
+    def user_message(self, content: dict) -> dict:
+        return {
+            'id': self.uuid(),
+            'author': {'role': 'user', 'name': None, 'metadata': {}},
+            'create_time': self.tick(),
+            'update_time': None,
+            'content': content,
+            'status': 'finished_successfully',
+            'end_turn': None,
+            'weight': 1.0,
+            'metadata': {
+                'request_id': self.uuid(),
+                'message_source': None,
+                'timestamp_': 'absolute',
+                'message_type': None,
+            },
+            'recipient': 'all',
+            'channel': None,
+        }
+
+    def assistant_message(
+        self,
+        content: dict,
+        recipient: str = 'all',
+        end_turn: bool | None = None,
+        metadata: dict | None = None,
+    ) -> dict:
+        metadata = {
+            'message_type': 'next',
+            'model_slug': self.model_slug,
+            'default_model_slug': self.model_slug,
+            'parent_id': self.uuid(),
+            'request_id': self.uuid(),
+            'timestamp_': 'absolute',
+            **(metadata or {}),
+        }
+        if end_turn:
+            metadata['finish_details'] = {'type': 'stop', 'stop_tokens': [200002]}
+            metadata['is_complete'] = True
+        return {
+            'id': self.uuid(),
+            'author': {'role': 'assistant', 'name': None, 'metadata': {}},
+            'create_time': self.tick(),
+            'update_time': None,
+            'content': content,
+            'status': 'finished_successfully',
+            'end_turn': end_turn,
+            'weight': 1.0,
+            'metadata': metadata,
+            'recipient': recipient,
+            'channel': None,
+        }
+
+    def tool_message(self, name: str, content: dict, metadata: dict) -> dict:
+        return {
+            'id': self.uuid(),
+            'author': {'role': 'tool', 'name': name, 'metadata': {}},
+            'create_time': self.tick(),
+            'update_time': self.time,
+            'content': content,
+            'status': 'finished_successfully',
+            'end_turn': None,
+            'weight': 1.0,
+            'metadata': {
+                'model_slug': self.model_slug,
+                'request_id': self.uuid(),
+                'timestamp_': 'absolute',
+                **metadata,
+            },
+            'recipient': 'all',
+            'channel': None,
+        }
+
+    def image_part(self) -> dict:
+        return {
+            'content_type': 'image_asset_pointer',
+            'asset_pointer': f'file-service://file-{self.rng.getrandbits(64):016x}',
+            'size_bytes': self.rng.randint(10_000, 2_000_000),
+            'width': self.rng.randint(200, 2000),
+            'height': self.rng.randint(200, 2000),
+            'fovea': None,
+            'metadata': {
+                'dalle': None,
+                'gizmo': None,
+                'generation': None,
+                'container_pixel_height': None,
+                'container_pixel_width': None,
+                'emu_omit_glimpse_image': None,
+                'emu_patches_override': None,
+                'sanitized': True,
+                'asset_pointer_link': None,
+                'watermarked_asset_pointer': None,
+            },
+        }
+
+    def text(self, min_words: int | None = None, max_words: int | None = None) -> str:
+        low, high = self.config.text_words
+        count = self.rng.randint(min_words or low, max_words or high)
+        return ' '.join(self.rng.choices(WORDS, k=count))
+
+    def code(self) -> str:
+        lines = [
+            f'{self.rng.choice(WORDS)}_{i} = {self.rng.randint(0, 999)}'
+            for i in range(self.rng.randint(1, 20))
+        ]
+        return '\n'.join(lines)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def tick(self) -> float:
+        self.time += self.rng.uniform(1, 120)
+        return self.time
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Opt-in timing and memory instrumentation for the pipeline scripts.
+
+Wrap a script's `main` with `@instrumented('<script name>')`, and each stage in it
+with `with stage('<stage name>') as s:`, setting `s.records` to the number of records
+it processed. For each stage, this records wall time, CPU time, peak RSS and the
+record count.
+
+Nothing is recorded unless one of these environment variables is set:
+
+- `PIPELINE_REPORT_DIR`: write a JSON report to `<dir>/<script>-report.json`
+- `PIPELINE_PROMETHEUS_DIR`: write a Prometheus textfile to `<dir>/<script>.prom`,
+  e.g. the directory of node exporter's textfile collector
+"""
+
+import functools
+import os
+import resource
+import sys
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from pydantic import BaseModel
+
+REPORT_DIR = os.environ.get('PIPELINE_REPORT_DIR')
+PROMETHEUS_DIR = os.environ.get('PIPELINE_PROMETHEUS_DIR')
+ENABLED = bool(REPORT_DIR or PROMETHEUS_DIR)
+
+METRIC_PREFIX = 'chatgpt_schema_stage'
+
+
+class StageMetrics(BaseModel):
+    name: str
+    records: int | None = None
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+
+
+class Report(BaseModel):
+    script: str
+    started_at: datetime
+    stages: list[StageMetrics] = []
+
+
+_report: Report | None = None
+
+
+def instrumented[**P, R](script: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    "Records the stages run by the decorated function, and writes them out after"
+
+    def decorator(fn: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(fn)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            global _report
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            _report = Report(script=script, started_at=datetime.now(timezone.utc))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                write_report(_report)
+                _report = None
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageMetrics]:
+    metrics = StageMetrics(name=name)
+    if _report is None:
+        yield metrics
+        return
+
+    reset_peak_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield metrics
+    finally:
+        metrics.wall_seconds = time.perf_counter() - wall_start
+        metrics.cpu_seconds = time.process_time() - cpu_start
+        metrics.peak_rss_mb = peak_rss_mb()
+        _report.stages.append(metrics)
+
+
+def reset_peak_rss() -> None:
+    "Resets the peak RSS reported by `peak_rss_mb`, where the OS supports it (Linux)"
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    "Peak RSS of this process, since the last `reset_peak_rss` on Linux"
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def write_report(report: Report) -> None:
+    if REPORT_DIR:
+        path = Path(REPORT_DIR) / f'{report.script}-report.json'
+        write_atomic(path, report.model_dump_json(indent=2))
+    if PROMETHEUS_DIR:
+        path = Path(PROMETHEUS_DIR) / f'{report.script}.prom'
+        write_atomic(path, format_prometheus(report))
+
+
+def format_prometheus(report: Report) -> str:
+    metrics = {
+        'wall_seconds': 'Wall time of the stage',
+        'cpu_seconds': 'CPU time of the stage',
+        'peak_rss_mb': 'Peak RSS during the stage, in MB',
+        'records': 'Records processed by the stage',
+    }
+    lines: list[str] = []
+    for field, help_text in metrics.items():
+        name = f'{METRIC_PREFIX}_{field}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for s in report.stages:
+            value = getattr(s, field)
+            if value is not None:
+                labels = f'script="{report.script}",stage="{s.name}"'
+                lines.append(f'{name}{{{labels}}} {value}')
+    name = f'{METRIC_PREFIX}_last_run_timestamp_seconds'
+    lines.append(f'# HELP {name} When the script started')
+    lines.append(f'# TYPE {name} gauge')
+    lines.append(f'{name}{{script="{report.script}"}} {report.started_at.timestamp()}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path: Path, text: str) -> None:
+    "So node exporter never reads a half-written file"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(text)
+    tmp.replace(path)
@@ -0,0 +1,329 @@
+"""
+Builds the message rows of `extract_rows.py` column by column.
+
+Instead of dumping each message, its content and its metadata to dicts and merging
+them into a row dict, each field is read straight off the models into a buffer per
+column. Every `batch_size` messages, the buffers are turned into a DataFrame with
+`row_schema.message_row_schema()` and cleared, so no row dicts are built, and only one
+batch is buffered in Python at a time.
+
+Only nested values (models and lists of models, for `Struct` columns) are dumped,
+and values stored as JSON are encoded the same way as `RowSchema.encode`.
+
+The items of the metadata fields left out of the message rows are gathered into rows
+of their own tables by `ChildRows`, in the same pass.
+"""
+
+import json
+from collections.abc import Iterable, Iterator
+from typing import Any
+import polars as pl
+from pydantic import BaseModel
+from model import assistant, tool
+from model.conversation import Conversation, Message
+from parquet_sink import PartSink
+from token_counts import TokenCounter
+from row_schema import (
+    CHILD_ROW_MODELS,
+    EXCLUDED_METADATA_FIELDS,
+    MESSAGE_FIELDS_REPLACED,
+    OPAQUE,
+    as_dtype,
+    child_row_schema,
+    encode_opaque,
+    message_row_schema,
+)
+
+# Messages per DataFrame. The buffers keep the models of a whole batch alive, so
+# memory use grows with this.
+BATCH_SIZE = 10_000
+
+# Columns that aren't fields of the message models, in the order they're filled
+TREE_COLUMNS = (
+    'convo_id',
+    'id',
+    'parent',
+    'children',
+    'is_active_path',
+    'depth',
+    'turn_index',
+)
+
+# Columns computed from the others by `MessageColumns.flush`, a batch at a time
+COMPUTED_COLUMNS = ('token_count', 'context_tokens')
+
+# Where a column's value comes from. Like the keys of a merged row dict, metadata
+# fields take precedence over content fields, which take precedence over message fields.
+MESSAGE, CONTENT, METADATA = range(3)
+
+type ColumnSource = tuple[list[Any], int, str, pl.DataType | None]
+
+
+def message_dataframe(convos: Iterable[Conversation]) -> pl.DataFrame:
+    batches = list(iter_message_batches(convos))
+    if not batches:
+        return pl.DataFrame(schema=message_row_schema().schema)
+    return pl.concat(batches)
+
+
+def iter_message_batches(
+    convos: Iterable[Conversation],
+    batch_size: int = BATCH_SIZE,
+    child_sinks: dict[str, PartSink] | None = None,
+    token_counter: TokenCounter | None = None,
+) -> Iterator[pl.DataFrame]:
+    """
+    With `child_sinks`, also writes the rows of each child table (see `ChildRows`) to
+    the sink of its metadata field, a batch at a time. Without `token_counter`,
+    `token_count` is null.
+    """
+    builder = MessageColumns(
+        children=child_sinks is not None, token_counter=token_counter
+    )
+
+    def flush() -> pl.DataFrame:
+        if child_sinks is not None and builder.children is not None:
+            for field, df in builder.children.flush().items():
+                child_sinks[field].write(df)
+        return builder.flush()
+
+    for convo in convos:
+        builder.add_convo(convo)
+        if builder.num_rows >= batch_size:
+            yield flush()
+    if builder.num_rows:
+        yield flush()
+
+
+class MessageColumns:
+    def __init__(
+        self, children: bool = False, token_counter: TokenCounter | None = None
+    ):
+        self.schema = message_row_schema()
+        self.children = ChildRows() if children else None
+        self.token_counter = token_counter
+        self.buffers: dict[str, list[Any]] = {
+            name: [] for name in self.schema.schema if name not in COMPUTED_COLUMNS
+        }
+        self.num_rows = 0
+        # How to fill every column, for each combination of message, content and
+        # metadata models
+        self.plans: dict[
+            tuple[type, type, type], tuple[list[ColumnSource], list[list[Any]]]
+        ] = {}
+
+    def add_convo(self, convo: Conversation) -> None:
+        tree = convo.tree()
+        active_ids = {m.id for m in convo.active_path()}
+        turn_index = get_turn_indexes(convo)
+
+        convo_ids = self.buffers['convo_id']
+        ids = self.buffers['id']
+        parents = self.buffers['parent']
+        children = self.buffers['children']
+        is_active_path = self.buffers['is_active_path']
+        depths = self.buffers['depth']
+        turn_indexes = self.buffers['turn_index']
+
+        for message in convo.mapping.values():
+            if message.role == 'root':
+                continue
+            i = tree.index[message.id]
+            convo_ids.append(convo.id)
+            ids.append(message.id)
+            parents.append(message.parent)
+            children.append(message.children)
+            is_active_path.append(message.id in active_ids)
+            depths.append(tree.depth[i])
+            turn_indexes.append(turn_index[i])
+
+            sources = (message, message.content, message.metadata)
+            fields, missing = self.plan(message)
+            for buffer, source, name, dtype in fields:
+                value = getattr(sources[source], name)
+                if dtype is not None and value is not None:
+                    value = encode_opaque(dump_nested(value), dtype)
+                buffer.append(value)
+            for buffer in missing:
+                buffer.append(None)
+            if self.children is not None:
+                self.children.add_message(convo.id, message)
+            self.num_rows += 1
+
+    def plan(self, message: Message) -> tuple[list[ColumnSource], list[list[Any]]]:
+        """
+        The columns filled from fields of `message`, and the columns it doesn't have.
+        For each column filled, `dtype` is set if its values have to be dumped.
+        """
+        key = (type(message), type(message.content), type(message.metadata))
+        if key in self.plans:
+            return self.plans[key]
+
+        fields: list[ColumnSource] = []
+        missing: list[list[Any]] = []
+        message_fields = type(message).model_fields.keys() - MESSAGE_FIELDS_REPLACED
+        content_fields = type(message.content).model_fields.keys()
+        metadata_fields = (
+            type(message.metadata).model_fields.keys() - EXCLUDED_METADATA_FIELDS
+        )
+        for name, buffer in self.buffers.items():
+            if name in TREE_COLUMNS:
+                continue
+            if name in metadata_fields:
+                source = METADATA
+            elif name in content_fields:
+                source = CONTENT
+            elif name in message_fields:
+                source = MESSAGE
+            else:
+                missing.append(buffer)
+                continue
+            dtype = self.schema.dtypes[name]
+            fields.append((buffer, source, name, dtype if is_nested(dtype) else None))
+
+        self.plans[key] = (fields, missing)
+        return fields, missing
+
+    def flush(self) -> pl.DataFrame:
+        "The buffered rows, as a DataFrame. Clears the buffers."
+        columns: list[pl.Series] = []
+        for name, buffer in self.buffers.items():
+            dtype = self.schema.schema[name]
+            if any(value is not None for value in buffer):
+                columns.append(pl.Series(name, buffer, dtype))
+            else:
+                # Most columns only apply to a few kinds of messages. Building these
+                # from a list of None is slow for nested types.
+                columns.append(
+                    pl.Series(name, [], dtype).extend_constant(None, len(buffer))
+                )
+        df = pl.DataFrame(columns)
+        if self.token_counter is not None:
+            token_count = self.token_counter.token_counts(df)
+            context_tokens = pl.Series(
+                get_context_tokens(
+                    self.buffers['convo_id'],
+                    self.buffers['id'],
+                    self.buffers['parent'],
+                    token_count.to_list(),
+                ),
+                dtype=pl.Int64,
+            )
+        else:
+            token_count = context_tokens = pl.lit(None, pl.Int64)
+        df = df.with_columns(
+            token_count=token_count, context_tokens=context_tokens
+        ).select(self.schema.schema.names())
+        for buffer in self.buffers.values():
+            buffer.clear()
+        self.num_rows = 0
+        return df
+
+
+class ChildRows:
+    """
+    The rows of the child tables (see `row_schema.child_row_schema`): one per item of
+    each of the metadata fields in `CHILD_ROW_MODELS`, and one per entry of each
+    search result group.
+
+    Unlike message rows, these are built as dicts, since each item is dumped whole.
+    """
+
+    def __init__(self):
+        self.rows: dict[str, list[dict]] = {field: [] for field in CHILD_ROW_MODELS}
+
+    def add_message(self, convo_id: str, message: Message) -> None:
+        for field, rows in self.rows.items():
+            items = getattr(message.metadata, field, None)
+            if not items:
+                continue
+            for ordinal, item in enumerate(items):
+                key = {
+                    'convo_id': convo_id,
+                    'message_id': message.id,
+                    'ordinal': ordinal,
+                }
+                if isinstance(
+                    item, (assistant.SearchResultGroup, tool.SearchResultGroup)
+                ):
+                    for entry_ordinal, entry in enumerate(item.entries):
+                        rows.append(
+                            key
+                            | {'entry_ordinal': entry_ordinal, 'domain': item.domain}
+                            | entry.model_dump()
+                        )
+                elif isinstance(item, BaseModel):
+                    rows.append(key | item.model_dump())
+                # Tool and system messages declare some of these as lists of `Any` or
+                # `None`, so their items are kept whole, as JSON
+                else:
+                    rows.append(key | {'item_json': json.dumps(item)})
+
+    def flush(self) -> dict[str, pl.DataFrame]:
+        "The rows of each table, as DataFrames. Clears the rows."
+        dfs = {
+            field: child_row_schema(field).dataframe(rows)
+            for field, rows in self.rows.items()
+        }
+        for rows in self.rows.values():
+            rows.clear()
+        return dfs
+
+
+def get_turn_indexes(convo: Conversation) -> list[int | None]:
+    """
+    For each node in `convo.tree()`, the 0-based index of the user turn it's part of,
+    counting user messages from the root. None before the first user message.
+    """
+    tree = convo.tree()
+    turn_index: list[int | None] = [None] * len(tree)
+    # Parents always come before their children in pre-order
+    for i in range(1, len(tree)):
+        parent_turn = turn_index[tree.parent[i]]
+        if convo.mapping[tree.ids[i]].role == 'user':
+            turn_index[i] = 0 if parent_turn is None else parent_turn + 1
+        else:
+            turn_index[i] = parent_turn
+    return turn_index
+
+
+def get_context_tokens(
+    convo_ids: list[str],
+    ids: list[str],
+    parents: list[str | None],
+    token_counts: list[int | None],
+) -> list[int]:
+    """
+    For each message row, the total `token_count` of it and all its ancestors, i.e.
+    the size of the context up to and including it. Messages without a count add 0.
+
+    Rows are in tree order, like `Conversation.mapping` (see
+    `parse_validate_clean.sort_mapping`), so every parent's total is known before its
+    children's, and each total is its parent's plus its own count, in one pass.
+    """
+    context_tokens: list[int] = []
+    totals: dict[tuple[str, str], int] = {}
+    for convo_id, id, parent, count in zip(convo_ids, ids, parents, token_counts):
+        # The root isn't a row, and counts as 0
+        total = totals.get((convo_id, parent), 0) if parent is not None else 0
+        total += count or 0
+        totals[(convo_id, id)] = total
+        context_tokens.append(total)
+    return context_tokens
+
+
+def is_nested(dtype: pl.DataType) -> bool:
+    "Whether values of `dtype` may hold models, or values stored as JSON"
+    if isinstance(dtype, (pl.Struct, OPAQUE)):
+        return True
+    if isinstance(dtype, pl.List):
+        return is_nested(as_dtype(dtype.inner))
+    return False
+
+
+def dump_nested(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if type(value) is list:
+        return [dump_nested(item) for item in value]
+    return value
@@ -0,0 +1,195 @@
+"""
+Writes parquet files from batches of rows as they're produced, instead of building
+the whole table in memory first.
+
+Each batch is written to a part file as it's produced, and the parts are streamed
+into the file by `sink_parquet`, so only a batch and the row group being written are
+in memory at once, however big the export is. (Polars 1.30 can't stream batches from
+a Python source, `register_io_source`, into a file if they have `Enum` columns.)
+
+Row groups are `ROW_GROUP_SIZE` rows, compressed with zstd and with min/max and null
+count statistics for every column, so readers can skip row groups that can't match a
+filter.
+
+`sink_partitioned` writes message rows as a hive-partitioned dataset instead, so
+readers can skip whole files too.
+
+Both also write the null count and an estimate of the distinct values of every column
+next to the data (see `column_stats.py`), so readers can tell which columns are empty
+without reading them.
+"""
+
+import itertools
+import os
+import shutil
+from collections.abc import Iterable
+import polars as pl
+from column_stats import ColumnStatsBuilder, write_column_stats
+from row_schema import RowSchema
+
+# Rows per row group. Smaller groups let readers skip more of a file when filtering,
+# larger ones compress better. A whole row group is buffered before it's written.
+ROW_GROUP_SIZE = 25_000
+COMPRESSION = 'zstd'
+# Rows per batch when sinking rows that are dicts
+ROW_BATCH_SIZE = 10_000
+# The hive partitions of datasets written by `sink_partitioned`
+PARTITION_COLUMNS = ['month', 'role']
+# How hive marks a null partition value, which Polars reads back as null
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def sink_batches(
+    batches: Iterable[pl.DataFrame],
+    schema: pl.Schema,
+    path: str,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> int:
+    "Writes `batches`, which all have `schema`, to `path`. Returns the number of rows."
+    sink = PartSink(path, schema)
+    for df in batches:
+        sink.write(df)
+    return sink.close(row_group_size)
+
+
+def sink_rows(
+    rows: Iterable[dict],
+    schema: RowSchema,
+    path: str,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> int:
+    "Like `sink_batches`, for rows that are dicts"
+    batches = (
+        schema.dataframe(list(batch))
+        for batch in itertools.batched(rows, ROW_BATCH_SIZE)
+    )
+    return sink_batches(batches, schema.schema, path, row_group_size)
+
+
+def sink_partitioned(
+    batches: Iterable[pl.DataFrame],
+    base_dir: str,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> int:
+    """
+    Like `sink_batches`, but writes a hive-partitioned dataset of message rows to
+    `base_dir`, by the year-month of `create_time` and by `role`, like
+    `month=2024-05/role=user/data.parquet`. Queries filtering on these only read the
+    matching files (see `scan_partitioned`). Within each file, rows are sorted by
+    `convo_id`, and keep their order within a conversation, so the row group
+    statistics of `convo_id` narrow down lookups of a conversation too.
+
+    Each batch is first split into one file per partition, then the files of each
+    partition are merged and sorted, one partition at a time. So memory use is bounded
+    by the largest partition, not the whole dataset. All the messages of a
+    conversation have to be in the same batch.
+
+    `base_dir` is replaced.
+    """
+    shutil.rmtree(base_dir, ignore_errors=True)
+    stats: ColumnStatsBuilder | None = None
+    partition_dirs: set[str] = set()
+    for batch_index, df in enumerate(batches):
+        df = df.with_columns(month=message_month())
+        if stats is None:
+            stats = ColumnStatsBuilder(df.schema)
+        stats.add(df)
+        for key, part in df.partition_by(PARTITION_COLUMNS, as_dict=True).items():
+            directory = partition_dir(base_dir, key)
+            os.makedirs(directory, exist_ok=True)
+            partition_dirs.add(directory)
+            part.drop(PARTITION_COLUMNS).write_parquet(
+                os.path.join(directory, f'part-{batch_index:06}.parquet'),
+                compression=COMPRESSION,
+            )
+
+    for directory in sorted(partition_dirs):
+        parts = sorted(
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.startswith('part-')
+        )
+        pl.scan_parquet(parts).sort('convo_id', maintain_order=True).sink_parquet(
+            os.path.join(directory, 'data.parquet'),
+            compression=COMPRESSION,
+            statistics=True,
+            row_group_size=row_group_size,
+        )
+        for path in parts:
+            os.remove(path)
+    if stats is None:
+        return 0
+    write_column_stats(stats.build(), base_dir)
+    return stats.num_rows
+
+
+class PartSink:
+    """
+    Writes the batches it's given to `path`, also for tables that are built alongside
+    the batches of another one, so they can be written in the same pass. Each batch
+    goes to a part file as it's given, and the parts are merged into `path` by `close`.
+    """
+
+    def __init__(self, path: str, schema: pl.Schema):
+        self.path = path
+        self.schema = schema
+        self.parts_dir = f'{path}.parts'
+        self.parts: list[str] = []
+        self.stats = ColumnStatsBuilder(schema)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def write(self, df: pl.DataFrame) -> None:
+        self.stats.add(df)
+        if df.is_empty():
+            return
+        os.makedirs(self.parts_dir, exist_ok=True)
+        part = os.path.join(self.parts_dir, f'part-{len(self.parts):06}.parquet')
+        df.write_parquet(part, compression=COMPRESSION)
+        self.parts.append(part)
+
+    def close(self, row_group_size: int = ROW_GROUP_SIZE) -> int:
+        "Writes `path` from the parts, and removes them. Returns the number of rows."
+        if self.parts:
+            lf = pl.scan_parquet(self.parts)
+        else:
+            lf = pl.LazyFrame(schema=self.schema)
+        lf.sink_parquet(
+            self.path,
+            compression=COMPRESSION,
+            statistics=True,
+            row_group_size=row_group_size,
+        )
+        write_column_stats(self.stats.build(), self.path)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        self.parts = []
+        return self.stats.num_rows
+
+
+def scan_partitioned(base_dir: str, schema: pl.Schema) -> pl.LazyFrame:
+    """
+    Scans a dataset written by `sink_partitioned`, whose rows had `schema`. The columns
+    are in the order of `schema`, followed by `month`.
+    """
+    return pl.scan_parquet(
+        os.path.join(base_dir, '**', '*.parquet'),
+        hive_partitioning=True,
+        hive_schema={'month': pl.String(), 'role': schema['role']},
+    ).select(*schema, 'month')
+
+
+def message_month() -> pl.Expr:
+    """
+    The year-month of each message's `create_time`, like `2024-05`. Messages without
+    one (like system messages) get the month of their conversation's first message.
+    """
+    create_time = pl.col('create_time')
+    create_time = create_time.fill_null(create_time.min().over('convo_id'))
+    return pl.from_epoch(create_time).dt.strftime('%Y-%m')
+
+
+def partition_dir(base_dir: str, key: tuple) -> str:
+    directory = base_dir
+    for name, value in zip(PARTITION_COLUMNS, key):
+        value = NULL_PARTITION if value is None else value
+        directory = os.path.join(directory, f'{name}={value}')
+    return directory
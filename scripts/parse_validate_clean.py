@@ -18,65 +18,465 @@ Our current approach is to validate each message type (UserMessage, SystemMessag
 first, and then validate Conversation last.
 This is mostly effective, but it's not perfect. `ToolMessage` in particular is very
 complex, with at least 6 different content types. All these unions make the validation
-errors less reliable. This could be improved by breaking up the values of `content` into
-groups based on `content.content_type`, and validating each group separately against its
-respective model.
+errors less reliable. So with `VALIDATE_CONTENT_BY_TYPE`, the values of `content` are
+broken up into groups based on the message role and `content.content_type`, and each
+group is validated separately against its respective model (see
+`bucketed_validation.py`).
 The `metadata` field `ToolMessage` is also highly complex and messy. It doesn't have its
 own key to identify its type. So breaking this field up into a union of different types
 might require a more hacky approach, like grouping them based on the node's `author.name`
 or `content.content_type`.
 """
 
+import os
 import re
-import pickle
 import json
+import itertools
+from collections import deque
+from collections.abc import Callable, Generator, Iterable, Iterator, Sized
+from concurrent.futures import Future, ProcessPoolExecutor
 from typing import Any
 import pydantic
 from pydantic import BaseModel
-from model.conversation import Conversation, Node
+from pydantic_core import ErrorDetails
+from model.conversation import Conversation, NORMALIZED, normalize_conversation
+from model.tree import TreeIndex
+from convo_store import STORE_PATH, ConvoStore, write_convos
+from bucketed_validation import validate_chunk_bucketed
+from instrumentation import instrumented, stage
+from validation_cache import (
+    clear_cache,
+    hash_raw,
+    load_cache,
+    model_fingerprint,
+    save_cache,
+)
 
 # Show the convo that failed validation
 DISPLAY_FAILED_RECORD = True
+# Validate every convo and print a summary of all errors, instead of stopping at the
+# first invalid convo. Useful for finding every schema change in a new export at once.
+COLLECT_ALL_ERRORS = False
+# Number of processes used to validate conversations. 1 validates serially.
+VALIDATION_WORKERS = 1
+# Number of conversations sent to a worker process at a time
+VALIDATION_CHUNK_SIZE = 64
+# Validate message contents in bulk by content type, before the rest of each convo.
+# Errors in contents are easier to read, but it isn't faster: 2.10s against 2.12s on
+# 1500 synthetic conversations, and slower on 300.
+VALIDATE_CONTENT_BY_TYPE = False
+# Reuse conversations that are unchanged since the last run, instead of validating them
+USE_VALIDATION_CACHE = True
+# UUIDs are shortened to this many characters
+UUID_LAST_CHARS = 16
+
+
+@instrumented('parse_validate_clean')
+def main():
+    fingerprint = model_fingerprint(UUID_LAST_CHARS)
+    cached_ids = load_cache(fingerprint) if USE_VALIDATION_CACHE else {}
+    previous = ConvoStore() if cached_ids and os.path.exists(STORE_PATH) else None
+
+    # Hash of each raw conversation, in export order
+    raw_hashes: list[str] = []
+    # Conversations from the previous run, by export index
+    reused: dict[int, Conversation] = {}
+
+    def uncached_convos() -> Iterator[dict]:
+        raw_convos = iter_json_array_with_raw('conversations.json')
+        for index, (raw_convo, raw_text) in enumerate(raw_convos):
+            raw_hash = hash_raw(raw_text)
+            raw_hashes.append(raw_hash)
+            convo_id = cached_ids.get(raw_hash)
+            if previous and convo_id is not None and convo_id in previous:
+                reused[index] = previous.get(convo_id)
+            else:
+                yield raw_convo
+
+    # Conversations reused from the cache aren't normalized again, so their UUIDs
+    # aren't part of the collision check below.
+    raw_convos = normalize_convos(
+        uncached_convos(), last_chars=UUID_LAST_CHARS, test=True
+    )
 
+    # Reading and normalizing are lazy, so they're part of this stage too
+    with stage('validate') as s:
+        # Since all messages are valid, now validate the conversations
+        if COLLECT_ALL_ERRORS:
+            validated, error_groups = collect_validation_errors(
+                Conversation,
+                raw_convos,
+                workers=VALIDATION_WORKERS,
+                chunk_size=VALIDATION_CHUNK_SIZE,
+                context={NORMALIZED: True},
+            )
+            if error_groups:
+                print(format_error_groups(error_groups))
+                quit()
+        else:
+            validated = validate_model(
+                Conversation,
+                raw_convos,
+                workers=VALIDATION_WORKERS,
+                chunk_size=VALIDATION_CHUNK_SIZE,
+                context={NORMALIZED: True},
+                bucketed=VALIDATE_CONTENT_BY_TYPE,
+            )
+        s.records = len(raw_hashes)
+    if previous:
+        previous.close()
+
+    # Put the validated and reused conversations back in export order
+    validated_iter = iter(validated)
+    convos = [
+        reused[index] if index in reused else next(validated_iter)
+        for index in range(len(raw_hashes))
+    ]
+    print(
+        f'Conversation is valid for all {len(convos)} records'
+        f' ({len(reused)} reused from cache).'
+    )
+    cache_entries = {h: convo.id for h, convo in zip(raw_hashes, convos)}
 
-def main():
-    with open('conversations.json', 'r') as f:
-        raw_convos = json.load(f)
+    with stage('sort_mapping') as s:
+        for convo in convos:
+            sort_mapping(convo)
+        s.records = len(convos)
 
-    raw_convos = shorten_all_uuids(raw_convos, last_chars=16, test=True)
+    convos = list(sorted(convos, key=lambda c: c.create_time, reverse=True))
 
-    # Since all messages are valid, now validate the conversations
-    convos = validate_model(Conversation, raw_convos)
-    print(f'Conversation is valid for all {len(convos)} records.')
+    # The cache only points into the new store once it's completely written. If this
+    # is interrupted, the next run finds no cache, and validates everything again.
+    clear_cache()
+    with stage('write_convos') as s:
+        s.records = write_convos(convos, STORE_PATH)
+    if USE_VALIDATION_CACHE:
+        save_cache(fingerprint, cache_entries)
 
-    for convo in convos:
-        sort_mapping(convo)
 
-    convos = list(sorted(convos, key=lambda c: c.create_time, reverse=True))
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    Yields the elements of the top-level JSON array in `path`, one at a time.
 
-    with open('1-conversations-clean.pkl', 'wb') as f:
-        pickle.dump(convos, f)
+    Unlike `json.load`, only the element being decoded (plus the read buffer) is held
+    in memory, so peak memory is bounded by the largest conversation rather than by
+    the size of the whole export.
+    """
+    for element, _ in iter_json_array_with_raw(path, chunk_size):
+        yield element
 
 
-def validate_model[T: BaseModel](model: type[T], documents: list[dict]) -> list[T]:
+def iter_json_array_with_raw(
+    path: str, chunk_size: int = 1 << 20
+) -> Iterator[tuple[Any, str]]:
+    """
+    Like `iter_json_array`, but yields each element along with its raw JSON text.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill(size: int) -> None:
+            nonlocal buf, pos, eof
+            chunk = f.read(size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_whitespace() -> None:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\n\r':
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill(chunk_size)
+
+        def expect(chars: str) -> str:
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buf) or buf[pos] not in chars:
+                found = buf[pos : pos + 20] if pos < len(buf) else 'end of file'
+                raise ValueError(
+                    f'Expected one of {chars!r} in {path}, found {found!r}'
+                )
+            pos += 1
+            return buf[pos - 1]
+
+        expect('[')
+        skip_whitespace()
+        if buf[pos : pos + 1] == ']':
+            return
+
+        while True:
+            skip_whitespace()
+            # Read more until the next element decodes completely. The read size grows
+            # with the buffer, so a huge element costs O(n) rather than O(n^2).
+            while True:
+                try:
+                    element, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    fill(max(chunk_size, len(buf)))
+                    continue
+                if end == len(buf) and not eof:
+                    # A number (or `true`, etc.) may continue in the next chunk
+                    fill(chunk_size)
+                    continue
+                break
+            raw = buf[pos:end]
+            pos = end
+            yield element, raw
+
+            if expect(',]') == ']':
+                return
+
+
+def validate_model[T: BaseModel](
+    model: type[T],
+    documents: Iterable[dict],
+    workers: int = 1,
+    chunk_size: int = 64,
+    context: dict[str, Any] | None = None,
+    bucketed: bool = False,
+) -> list[T]:
     """
     Validates each item in `documents` against `model`.
+    `documents` may be a generator, in which case it is consumed one item at a time.
+
+    With `workers > 1`, documents are sent to a process pool in chunks of `chunk_size`.
+    Results are still returned in input order, and the first failure (by index) is
+    reported exactly as in serial mode.
+
+    `context` is passed to pydantic as the validation context.
+
+    With `bucketed`, each chunk is validated by `validate_chunk_bucketed`. This only
+    works for normalized conversations.
     """
+    if workers > 1 or bucketed:
+        chunk_fn = validate_chunk_bucketed if bucketed else validate_chunk
+        return validate_model_chunked(
+            model, documents, workers, chunk_size, context, chunk_fn
+        )
 
     results: list[T] = []
     for index, doc in enumerate(documents):
         try:
-            results.append(model(**doc))
+            results.append(model.model_validate(doc, context=context))
         except pydantic.ValidationError as e:
-            if DISPLAY_FAILED_RECORD:
-                print('\n\n\n\n\n' + json.dumps(doc, indent=4) + '\n')
-            print(format_error(str(e)))
-            print(f'\nFailed on {model.__name__} {index} / {len(documents)}')
+            report_validation_error(model, documents, index, doc, str(e))
             quit()
 
     return results
 
 
+def validate_model_chunked[T: BaseModel](
+    model: type[T],
+    documents: Iterable[dict],
+    workers: int,
+    chunk_size: int,
+    context: dict[str, Any] | None,
+    chunk_fn: Callable[..., tuple[list[T], tuple[int, str] | None]],
+) -> list[T]:
+    results: list[T] = []
+    chunk_results = map_chunks_in_order(
+        chunk_fn, documents, workers, chunk_size, model, context
+    )
+    for start, chunk, (validated, failure) in chunk_results:
+        if failure is not None:
+            offset, err = failure
+            chunk_results.close()
+            report_validation_error(
+                model, documents, start + offset, chunk[offset], err
+            )
+            quit()
+        results.extend(validated)
+
+    return results
+
+
+def map_chunks_in_order[R](
+    fn: Callable[..., R],
+    documents: Iterable[dict],
+    workers: int,
+    chunk_size: int,
+    *args: Any,
+) -> Generator[tuple[int, tuple[dict, ...], R]]:
+    """
+    Calls `fn(*args, chunk)` in a process pool for each chunk of `chunk_size`
+    documents, and yields `(index of the chunk's first document, chunk, result)` in
+    input order. With `workers <= 1`, chunks are processed in this process instead.
+    """
+    chunks = enumerate(itertools.batched(documents, chunk_size))
+    if workers <= 1:
+        for chunk_index, chunk in chunks:
+            yield chunk_index * chunk_size, chunk, fn(*args, chunk)
+        return
+
+    # Only a few chunks are in flight at a time, so a streamed input is never fully
+    # materialized in the parent process.
+    max_in_flight = workers * 2
+    pending: deque[tuple[int, tuple[dict, ...], Future[R]]] = deque()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit_next() -> bool:
+            item = next(chunks, None)
+            if item is None:
+                return False
+            chunk_index, chunk = item
+            future = executor.submit(fn, *args, chunk)
+            pending.append((chunk_index * chunk_size, chunk, future))
+            return True
+
+        try:
+            while len(pending) < max_in_flight and submit_next():
+                pass
+
+            while pending:
+                start, chunk, future = pending.popleft()
+                yield start, chunk, future.result()
+                submit_next()
+        finally:
+            for *_, future in pending:
+                future.cancel()
+
+
+def validate_chunk[T: BaseModel](
+    model: type[T],
+    context: dict[str, Any] | None,
+    chunk: tuple[dict, ...],
+) -> tuple[list[T], tuple[int, str] | None]:
+    """
+    Runs in a worker process. Returns the validated models, and on the first failure,
+    its offset within `chunk` and the error message. `ValidationError` itself is not
+    sent back, since it doesn't survive pickling intact.
+    """
+    validated: list[T] = []
+    for offset, doc in enumerate(chunk):
+        try:
+            validated.append(model.model_validate(doc, context=context))
+        except pydantic.ValidationError as e:
+            return validated, (offset, str(e))
+    return validated, None
+
+
+class ErrorGroup(BaseModel):
+    "Validation errors that share a location path and error type"
+
+    loc: str
+    type: str
+    count: int = 0
+    msg: str
+    convo_ids: list[str] = []
+
+
+def collect_validation_errors[T: BaseModel](
+    model: type[T],
+    documents: Iterable[dict],
+    workers: int = 1,
+    chunk_size: int = 64,
+    context: dict[str, Any] | None = None,
+    max_examples: int = 3,
+) -> tuple[list[T], list[ErrorGroup]]:
+    """
+    Validates every item in `documents`, instead of stopping at the first failure.
+
+    Returns the valid models (in input order), and every error grouped by location
+    path and error type, most frequent first. Each group keeps up to `max_examples`
+    ids of conversations it occurred in.
+    """
+    chunk_results = map_chunks_in_order(
+        collect_chunk_errors, documents, workers, chunk_size, model, context
+    )
+    results: list[T] = []
+    groups: dict[tuple[str, str], ErrorGroup] = {}
+    for _, _, (validated, failures) in chunk_results:
+        results.extend(validated)
+        for doc_id, errors in failures:
+            for error in errors:
+                loc = generalize_loc(error['loc'])
+                group = groups.get((loc, error['type']))
+                if group is None:
+                    group = ErrorGroup(loc=loc, type=error['type'], msg=error['msg'])
+                    groups[(loc, error['type'])] = group
+                group.count += 1
+                if (
+                    len(group.convo_ids) < max_examples
+                    and doc_id not in group.convo_ids
+                ):
+                    group.convo_ids.append(doc_id)
+
+    return results, sorted(groups.values(), key=lambda g: g.count, reverse=True)
+
+
+def collect_chunk_errors[T: BaseModel](
+    model: type[T],
+    context: dict[str, Any] | None,
+    chunk: Iterable[dict],
+) -> tuple[list[T], list[tuple[str, list[ErrorDetails]]]]:
+    """
+    Returns the valid models in `chunk`, and for each invalid document, its id and
+    its errors (without inputs or context, which can be huge or unpicklable).
+    """
+    validated: list[T] = []
+    failures: list[tuple[str, list[ErrorDetails]]] = []
+    for doc in chunk:
+        try:
+            validated.append(model.model_validate(doc, context=context))
+        except pydantic.ValidationError as e:
+            errors = e.errors(
+                include_url=False, include_input=False, include_context=False
+            )
+            failures.append((str(doc.get('id')), errors))
+    return validated, failures
+
+
+def generalize_loc(loc: tuple[int | str, ...]) -> str:
+    """
+    Joins an error location into a path that's the same across conversations, by
+    replacing list indices and `mapping` node ids with `*`.
+    """
+    parts: list[str] = []
+    for i, part in enumerate(loc):
+        if isinstance(part, int) or (i > 0 and loc[i - 1] == 'mapping'):
+            parts.append('*')
+        else:
+            parts.append(part)
+    return '.'.join(parts)
+
+
+def format_error_groups(groups: list[ErrorGroup]) -> str:
+    lines = [f'{sum(g.count for g in groups)} errors in {len(groups)} groups', '']
+    for g in groups:
+        lines.append(f'{g.count:>7}  {g.loc}  [{g.type}]')
+        lines.append(f'         {g.msg}')
+        lines.append(f'         e.g. {", ".join(g.convo_ids)}')
+    return '\n'.join(lines)
+
+
+def report_validation_error(
+    model: type[BaseModel],
+    documents: Iterable[dict],
+    index: int,
+    doc: dict,
+    err: str,
+) -> None:
+    if DISPLAY_FAILED_RECORD:
+        # Contents may already be validated models, with bucketed validation
+        dumped = json.dumps(
+            doc, indent=4, default=lambda m: m.model_dump(by_alias=True)
+        )
+        print('\n\n\n\n\n' + dumped + '\n')
+    print(format_error(err))
+    total = len(documents) if isinstance(documents, Sized) else '?'
+    print(f'\nFailed on {model.__name__} {index} / {total}')
+
+
 def format_error(err: str) -> str:
     "Tweaks, such as removing unnecessary URL lines from the error message"
     lines = err.split('\n')
@@ -87,7 +487,13 @@ def format_error(err: str) -> str:
     return '\n'.join(lines)
 
 
-def shorten_all_uuids(data: Any, last_chars: int, test: bool = False) -> Any:
+def shorten_all_uuids(
+    data: Any,
+    last_chars: int,
+    test: bool = False,
+    full_uuids_seen: set[str] | None = None,
+    shortened_uuids: set[str] | None = None,
+) -> Any:
     def shorten_all_uuids_rec(obj: Any) -> Any:
         if isinstance(obj, dict):
             return {
@@ -98,12 +504,39 @@ def shorten_all_uuids(data: Any, last_chars: int, test: bool = False) -> Any:
             return [shorten_all_uuids_rec(x) for x in obj]
         if isinstance(obj, tuple):
             return tuple(shorten_all_uuids_rec(x) for x in obj)
-        if isinstance(obj, str) and is_uuid(obj):
-            return shorten_uuid(obj)
+        if isinstance(obj, str):
+            return shorten_if_uuid(obj)
         return obj
 
-    full_uuids_seen: set[str] = set()
-    shortened_uuids: set[str] = set()
+    if full_uuids_seen is None:
+        full_uuids_seen = set()
+    if shortened_uuids is None:
+        shortened_uuids = set()
+
+    shorten_if_uuid = make_uuid_shortener(
+        last_chars, test, full_uuids_seen, shortened_uuids
+    )
+    result = shorten_all_uuids_rec(data)
+    assert len(full_uuids_seen) == len(shortened_uuids)
+    return result
+
+
+def make_uuid_shortener(
+    last_chars: int,
+    test: bool = False,
+    full_uuids_seen: set[str] | None = None,
+    shortened_uuids: set[str] | None = None,
+) -> Callable[[str], str]:
+    """
+    Returns a function that shortens a string to its last `last_chars` characters if
+    it's a UUID, and returns any other string unchanged.
+    With `test`, full and shortened UUIDs are recorded in the given sets, so that
+    callers can check that no two UUIDs were shortened to the same value.
+    """
+    if full_uuids_seen is None:
+        full_uuids_seen = set()
+    if shortened_uuids is None:
+        shortened_uuids = set()
 
     if test:
 
@@ -133,29 +566,43 @@ def shorten_all_uuids(data: Any, last_chars: int, test: bool = False) -> Any:
     )
 
     def is_uuid(s: str) -> bool:
+        # Cheap length check first, since most strings are message text
+        if len(s) != 36:
+            return False
         return bool(UUID_RE_LOWER.match(s)) or bool(UUID_RE_UPPER.match(s))
 
-    result = shorten_all_uuids_rec(data)
-    assert len(full_uuids_seen) == len(shortened_uuids)
-    return result
-
+    def shorten_if_uuid(s: str) -> str:
+        return shorten_uuid(s) if is_uuid(s) else s
 
-def sort_mapping(convo: Conversation) -> None:
-    num_messages = len(convo.mapping)
-    sorted_nodes: list[Node] = []
+    return shorten_if_uuid
 
-    def add_node(id: str) -> None:
-        node = convo.mapping[id]
-        sorted_nodes.append(node)
-        for child in node.children:
-            add_node(child)
 
-    root = convo.get_root_node()
-    add_node(root.id)
+def normalize_convos(
+    raw_convos: Iterable[dict], last_chars: int, test: bool = False
+) -> Iterator[dict]:
+    """
+    Shortens UUIDs, nullifies empty dicts and flattens message nodes of each raw
+    conversation in a single pass. Validate the results with
+    `context={NORMALIZED: True}`.
+    """
+    # Shared across conversations, so that shortened ids are checked for collisions
+    # over the whole export, not just within a single conversation.
+    full_uuids_seen: set[str] = set()
+    shortened_uuids: set[str] = set()
+    shorten_if_uuid = make_uuid_shortener(
+        last_chars, test, full_uuids_seen, shortened_uuids
+    )
+    for raw_convo in raw_convos:
+        normalized = normalize_conversation(raw_convo, transform_str=shorten_if_uuid)
+        assert len(full_uuids_seen) == len(shortened_uuids)
+        yield normalized
 
-    assert num_messages == len(sorted_nodes)
 
-    convo.mapping = {node.id: node for node in sorted_nodes}
+def sort_mapping(convo: Conversation) -> None:
+    "Orders `mapping` depth-first from the root, so each branch is contiguous"
+    tree = TreeIndex(convo.mapping)
+    assert len(tree) == len(convo.mapping)
+    convo.mapping = {id: convo.mapping[id] for id in tree.ids}
 
 
 if __name__ == '__main__':
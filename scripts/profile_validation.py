@@ -0,0 +1,58 @@
+"""
+Profiles validating `conversations.json`, and prints where the time goes: calls, self
+time and total time for each model class, and for each `field_validator` and
+`model_validator` in `model/`.
+
+Self time excludes nested models and validators, so e.g. `conversation.Conversation`
+doesn't include the time spent validating its messages. Union members that pydantic
+tries and rejects are counted too.
+
+Profiling adds a Python call around every model, so absolute times are inflated. Use
+it to compare models and validators with each other, not with `benchmark.py`.
+"""
+
+import os
+
+# Must be set before the models are imported (see `model/profiling.py`)
+os.environ['PROFILE_VALIDATION'] = '1'
+
+import time  # noqa: E402
+import itertools  # noqa: E402
+from model.conversation import Conversation, NORMALIZED  # noqa: E402
+from model.profiling import format_profile, reset_profile  # noqa: E402
+from parse_validate_clean import (  # noqa: E402
+    UUID_LAST_CHARS,
+    VALIDATE_CONTENT_BY_TYPE,
+    iter_json_array,
+    normalize_convos,
+    validate_model,
+)
+
+EXPORT_PATH = 'conversations.json'
+# Only profile the first this many conversations. None profiles all of them.
+MAX_CONVOS: int | None = None
+# Only print this many rows. None prints all of them.
+MAX_ROWS: int | None = None
+
+
+def main():
+    raw_convos = normalize_convos(iter_json_array(EXPORT_PATH), UUID_LAST_CHARS)
+    # Decode and normalize up front, so only validation is profiled
+    raw_convos = list(itertools.islice(raw_convos, MAX_CONVOS))
+
+    reset_profile()
+    start = time.perf_counter()
+    convos = validate_model(
+        Conversation,
+        raw_convos,
+        context={NORMALIZED: True},
+        bucketed=VALIDATE_CONTENT_BY_TYPE,
+    )
+    seconds = time.perf_counter() - start
+
+    print(f'Validated {len(convos)} conversations in {seconds:.3f}s (profiled)\n')
+    print(format_profile(MAX_ROWS))
+
+
+if __name__ == '__main__':
+    main()
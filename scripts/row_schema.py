@@ -0,0 +1,318 @@
+"""
+Derives explicit Polars schemas for the rows built by `extract_rows.py` from the
+pydantic models in `model/`, so DataFrames don't have to scan every row to infer
+types.
+
+Type annotations map to Polars types like this:
+
+- `str`, `int`, `float`, `bool`, `None`: `String`, `Int64`, `Float64`, `Boolean`, `Null`
+- a `Literal` of strings, like `ModelName`, `DefaultToolName`, roles, statuses and
+  `content_type`: an `Enum` of its values (unions of them are merged into one `Enum`)
+- a model: a `Struct` of its fields, and a union of models: a `Struct` of all their
+  fields
+- `list[T]`: a `List` of `T`
+
+A few fields get a type other than their annotation's, listed in `FIELD_DTYPES`.
+
+Anything that can't be mapped to a single type, like `Any`, `dict[str, ...]`, or
+`str | list[Any]`, is stored as a JSON string. `RowSchema.encode` does that
+conversion on a row before it's given to Polars, and
+`RowSchema.dataframe` builds a DataFrame from rows with it.
+
+A column that's in more than one model (e.g. `text` in most content types) gets the
+supertype of all of them.
+
+The lists in `EXCLUDED_METADATA_FIELDS` are the biggest nested values, so each goes
+to a table of its own (see `child_row_schema`), with a row per item.
+"""
+
+import json
+from functools import cache
+from types import NoneType, UnionType
+from typing import (
+    Annotated,
+    Any,
+    Literal,
+    TypeAliasType,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+import polars as pl
+from polars._typing import PolarsDataType
+from pydantic import BaseModel
+from model import assistant, contentref, system, tool
+from model.conversation import Conversation, Message
+from bucketed_validation import union_members
+
+# The metadata fields left out of the message rows, and the models of their items,
+# which make up the rows of their own tables. Search result groups get a row per
+# entry.
+CHILD_ROW_MODELS: dict[str, list[type[BaseModel]]] = {
+    'content_references': [contentref.ContentReference],
+    'citations': [assistant.Citation],
+    'search_result_groups': [assistant.SearchResultGroupEntry, tool.SearchResultEntry],
+    'image_results': [contentref.Image],
+}
+EXCLUDED_METADATA_FIELDS = set(CHILD_ROW_MODELS)
+# Fields of the message models that aren't taken as is
+MESSAGE_FIELDS_REPLACED = {'id', 'parent', 'children', 'content', 'metadata'}
+
+# Fields whose values get a different type in the rows than their annotation gives.
+# System messages type their stop tokens as floats, but they're token ids, like the
+# integer stop tokens of assistant messages, and share their column.
+FIELD_DTYPES: dict[tuple[type[BaseModel], str], pl.DataType] = {
+    (system.FinishDetails, 'stop_tokens'): pl.List(pl.Int64()),
+}
+
+# Stands for values stored as JSON strings, until `RowSchema` replaces it with `String`
+OPAQUE = pl.Object
+
+
+class RowSchema:
+    def __init__(self, dtypes: dict[str, pl.DataType]):
+        # With `OPAQUE` in place of every value that's stored as JSON
+        self.dtypes = dtypes
+        self.schema = pl.Schema(
+            {name: finalize(dtype) for name, dtype in dtypes.items()}
+        )
+        # Columns with a value somewhere in them that's stored as JSON
+        self.json_columns = {
+            name: dtype for name, dtype in dtypes.items() if contains_opaque(dtype)
+        }
+
+    def dataframe(self, rows: list[dict]) -> pl.DataFrame:
+        return pl.DataFrame([self.encode(row) for row in rows], schema=self.schema)
+
+    def encode(self, row: dict) -> dict:
+        "Encodes the values of `row` that are stored as JSON, in place"
+        for name, dtype in self.json_columns.items():
+            if name in row:
+                row[name] = encode_opaque(row[name], dtype)
+        return row
+
+
+@cache
+def message_row_schema() -> RowSchema:
+    "The schema of the rows built by `message_columns.MessageColumns`"
+    dtypes: dict[str, pl.DataType] = {
+        'convo_id': pl.String(),
+        'id': pl.String(),
+        'parent': pl.String(),
+        'children': pl.List(pl.String()),
+        'is_active_path': pl.Boolean(),
+        'depth': pl.Int64(),
+        'turn_index': pl.Int64(),
+        'token_count': pl.Int64(),
+        'context_tokens': pl.Int64(),
+    }
+    message_models = union_members(Message)
+    content_models = [
+        m
+        for message_model in message_models
+        for m in union_members(message_model.model_fields['content'].annotation)
+    ]
+    metadata_models = [
+        m
+        for message_model in message_models
+        for m in union_members(message_model.model_fields['metadata'].annotation)
+    ]
+    # Same order as the keys of each row
+    for models, excluded in [
+        (message_models, MESSAGE_FIELDS_REPLACED),
+        (content_models, set()),
+        (metadata_models, EXCLUDED_METADATA_FIELDS),
+    ]:
+        for model in models:
+            add_model_fields(dtypes, model, excluded)
+    return RowSchema(dtypes)
+
+
+@cache
+def convo_row_schema() -> RowSchema:
+    "The schema of the rows built by `extract_rows.iter_convo_rows`"
+    dtypes: dict[str, pl.DataType] = {}
+    add_model_fields(dtypes, Conversation, {'mapping'})
+    dtypes['message_count'] = pl.Int64()
+    dtypes['turn_count'] = pl.Int64()
+    dtypes['model_slugs_used'] = pl.String()
+    dtypes['tools_used'] = pl.String()
+    dtypes['content_types'] = pl.String()
+    return RowSchema(dtypes)
+
+
+@cache
+def child_row_schema(field: str) -> RowSchema:
+    """
+    The schema of the rows built from the items of the metadata `field`, by
+    `message_columns.ChildRows`. Rows are keyed by their message and the `ordinal` of
+    their item. Items that aren't models, which some messages declare as `Any`, are
+    stored whole in `item_json`.
+    """
+    dtypes: dict[str, pl.DataType] = {
+        'convo_id': pl.String(),
+        'message_id': pl.String(),
+        'ordinal': pl.Int64(),
+        'item_json': pl.String(),
+    }
+    if field == 'search_result_groups':
+        dtypes['entry_ordinal'] = pl.Int64()
+        dtypes['domain'] = pl.String()
+    for model in CHILD_ROW_MODELS[field]:
+        add_model_fields(dtypes, model, set())
+    return RowSchema(dtypes)
+
+
+def add_model_fields(
+    dtypes: dict[str, pl.DataType], model: type[BaseModel], excluded: set[str]
+) -> None:
+    for name, annotation in field_annotations(model).items():
+        if name in excluded:
+            continue
+        dtype = field_dtype(model, name, annotation)
+        dtypes[name] = merge_dtypes(dtypes[name], dtype) if name in dtypes else dtype
+
+
+@cache
+def field_annotations(model: type[BaseModel]) -> dict[str, Any]:
+    """
+    The annotation of each field of `model`. Unlike `FieldInfo.annotation`, these
+    never contain forward references, which the models use for types defined later in
+    their module.
+    """
+    hints = get_type_hints(model, include_extras=True)
+    return {name: hints[name] for name in model.model_fields}
+
+
+def field_dtype(
+    model: type[BaseModel], name: str, annotation: Any, seen: tuple[type, ...] = ()
+) -> pl.DataType:
+    if (model, name) in FIELD_DTYPES:
+        return FIELD_DTYPES[model, name]
+    return polars_dtype(annotation, seen)
+
+
+def polars_dtype(annotation: Any, seen: tuple[type, ...] = ()) -> pl.DataType:
+    "`seen` holds the models being mapped, so recursive models become `OPAQUE`"
+    if isinstance(annotation, TypeAliasType):
+        return polars_dtype(annotation.__value__, seen)
+    origin = get_origin(annotation)
+    if origin is Annotated:
+        return polars_dtype(get_args(annotation)[0], seen)
+    if origin in (Union, UnionType):
+        dtypes = [polars_dtype(arg, seen) for arg in get_args(annotation)]
+        result = dtypes[0]
+        for dtype in dtypes[1:]:
+            result = merge_dtypes(result, dtype)
+        return result
+    if origin is Literal:
+        return literal_dtype(get_args(annotation))
+    if origin is list:
+        (item,) = get_args(annotation)
+        return pl.List(polars_dtype(item, seen))
+    if annotation is None or annotation is NoneType:
+        return pl.Null()
+    if annotation is str:
+        return pl.String()
+    # Before int, since bool is a subclass of int
+    if annotation is bool:
+        return pl.Boolean()
+    if annotation is int:
+        return pl.Int64()
+    if annotation is float:
+        return pl.Float64()
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        if annotation in seen:
+            return OPAQUE()
+        return pl.Struct(
+            {
+                name: field_dtype(
+                    annotation, name, field_annotation, seen + (annotation,)
+                )
+                for name, field_annotation in field_annotations(annotation).items()
+            }
+        )
+    # Any, dict[...], ...
+    return OPAQUE()
+
+
+def literal_dtype(values: tuple[Any, ...]) -> pl.DataType:
+    if all(isinstance(v, str) for v in values):
+        return pl.Enum(list(dict.fromkeys(values)))
+    if all(isinstance(v, bool) for v in values):
+        return pl.Boolean()
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return pl.Int64()
+    return OPAQUE()
+
+
+def merge_dtypes(a: pl.DataType, b: pl.DataType) -> pl.DataType:
+    "The narrowest type that can hold the values of both `a` and `b`"
+    if a == b:
+        return a
+    if isinstance(a, pl.Null):
+        return b
+    if isinstance(b, pl.Null):
+        return a
+    if isinstance(a, OPAQUE) or isinstance(b, OPAQUE):
+        return OPAQUE()
+    if isinstance(a, pl.Enum) and isinstance(b, pl.Enum):
+        return pl.Enum(list(dict.fromkeys([*a.categories, *b.categories])))
+    if isinstance(a, (pl.Enum, pl.String)) and isinstance(b, (pl.Enum, pl.String)):
+        return pl.String()
+    if {type(a), type(b)} == {pl.Int64, pl.Float64}:
+        return pl.Float64()
+    if isinstance(a, pl.List) and isinstance(b, pl.List):
+        return pl.List(merge_dtypes(as_dtype(a.inner), as_dtype(b.inner)))
+    if isinstance(a, pl.Struct) and isinstance(b, pl.Struct):
+        fields = {f.name: as_dtype(f.dtype) for f in a.fields}
+        for f in b.fields:
+            dtype = as_dtype(f.dtype)
+            fields[f.name] = (
+                merge_dtypes(fields[f.name], dtype) if f.name in fields else dtype
+            )
+        return pl.Struct(fields)
+    return OPAQUE()
+
+
+def contains_opaque(dtype: pl.DataType) -> bool:
+    if isinstance(dtype, OPAQUE):
+        return True
+    if isinstance(dtype, pl.List):
+        return contains_opaque(as_dtype(dtype.inner))
+    if isinstance(dtype, pl.Struct):
+        return any(contains_opaque(as_dtype(f.dtype)) for f in dtype.fields)
+    return False
+
+
+def finalize(dtype: pl.DataType) -> pl.DataType:
+    "Replaces `OPAQUE` with `String`"
+    if isinstance(dtype, OPAQUE):
+        return pl.String()
+    if isinstance(dtype, pl.List):
+        return pl.List(finalize(as_dtype(dtype.inner)))
+    if isinstance(dtype, pl.Struct):
+        return pl.Struct({f.name: finalize(as_dtype(f.dtype)) for f in dtype.fields})
+    return dtype
+
+
+def encode_opaque(value: Any, dtype: pl.DataType) -> Any:
+    if value is None:
+        return None
+    if isinstance(dtype, OPAQUE):
+        return json.dumps(value)
+    if isinstance(dtype, pl.List):
+        return [encode_opaque(item, as_dtype(dtype.inner)) for item in value]
+    if isinstance(dtype, pl.Struct):
+        fields = {f.name: as_dtype(f.dtype) for f in dtype.fields}
+        return {
+            k: encode_opaque(v, fields[k]) if k in fields else v
+            for k, v in value.items()
+        }
+    return value
+
+
+def as_dtype(dtype: PolarsDataType) -> pl.DataType:
+    "The types inside a `List` or `Struct` may be classes, like `pl.String`"
+    return dtype if isinstance(dtype, pl.DataType) else dtype()
@@ -0,0 +1,193 @@
+"""
+A full-text index of message text and conversation titles, in a SQLite database with
+FTS5, built from the rows written by `extract_rows.py`. Use `search` to find messages
+and conversations by their content, without loading any parquet.
+
+Only the `text` of user, assistant and tool messages is indexed. Messages and titles
+are kept in plain tables, with FTS5 indexes over them that triggers keep in sync (an
+"external content" index), so a conversation's rows can be replaced by their id.
+
+Updates are incremental. A conversation is only reindexed when its `update_time`
+changes, which it does whenever a message is added, and conversations that are no
+longer in the export are removed.
+"""
+
+import sqlite3
+import polars as pl
+from polars import col
+from analyze_messages import message_rows_path, scan_message_rows
+from extract_rows import CONVO_ROWS_PATH
+from instrumentation import instrumented, stage
+
+INDEX_PATH = '3-conversations-search.db'
+INDEXED_ROLES = ['user', 'assistant', 'tool']
+# Conversations reindexed per transaction
+BATCH_SIZE = 1_000
+
+QUERY = 'polars'
+MAX_RESULTS = 20
+# Words of context around the matches in each snippet
+SNIPPET_WORDS = 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS convos (
+    rowid INTEGER PRIMARY KEY,
+    convo_id TEXT NOT NULL UNIQUE,
+    title TEXT,
+    update_time REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    convo_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_convo_id ON messages (convo_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS convos_fts USING fts5(
+    title, content='convos', content_rowid='rowid'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='rowid'
+);
+
+CREATE TRIGGER IF NOT EXISTS convos_insert AFTER INSERT ON convos BEGIN
+    INSERT INTO convos_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS convos_delete AFTER DELETE ON convos BEGIN
+    INSERT INTO convos_fts (convos_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+"""
+
+
+@instrumented('search_index')
+def main():
+    db = connect()
+    with stage('update_index') as s:
+        s.records = update_index(db)
+    print(f'Reindexed {s.records} conversations in {INDEX_PATH}')
+
+    with stage('search') as s:
+        results = search(db, QUERY, MAX_RESULTS)
+        s.records = len(results)
+    db.close()
+    df = pl.DataFrame(
+        results, schema=['convo_id', 'message_id', 'snippet'], orient='row'
+    )
+    print(df)
+
+
+def connect(path: str = INDEX_PATH) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def update_index(db: sqlite3.Connection) -> int:
+    """
+    Reindexes the conversations that are new or changed since the last update, and
+    removes the ones that are gone. Returns the number reindexed.
+    """
+    df_convos = pl.read_parquet(CONVO_ROWS_PATH, columns=['id', 'title', 'update_time'])
+    indexed = dict(db.execute('SELECT convo_id, update_time FROM convos').fetchall())
+
+    removed = indexed.keys() - set(df_convos['id'])
+    with db:
+        for convo_id in removed:
+            delete_convo(db, convo_id)
+
+    indexed_update_time = col('id').replace_strict(
+        indexed, default=None, return_dtype=pl.Float64
+    )
+    changed = df_convos.filter(
+        ~col('id').is_in(list(indexed))
+        | col('update_time').ne_missing(indexed_update_time)
+    )
+    for batch in changed.iter_slices(BATCH_SIZE):
+        convo_ids = batch['id'].to_list()
+        # Only the messages of these conversations are read (see
+        # `analyze_messages.get_all_messages`)
+        df_messages = (
+            scan_message_rows(message_rows_path())
+            .filter(
+                col('convo_id').is_in(convo_ids),
+                col('role').cast(pl.String).is_in(INDEXED_ROLES),
+                col('text').is_not_null(),
+                col('text') != '',
+            )
+            .select('convo_id', 'id', 'text')
+            .collect()
+        )
+        with db:
+            for convo_id in convo_ids:
+                delete_convo(db, convo_id)
+            db.executemany(
+                'INSERT INTO convos (convo_id, title, update_time) VALUES (?, ?, ?)',
+                batch.iter_rows(),
+            )
+            db.executemany(
+                'INSERT INTO messages (convo_id, message_id, text) VALUES (?, ?, ?)',
+                df_messages.iter_rows(),
+            )
+    return len(changed)
+
+
+def delete_convo(db: sqlite3.Connection, convo_id: str) -> None:
+    db.execute('DELETE FROM messages WHERE convo_id = ?', (convo_id,))
+    db.execute('DELETE FROM convos WHERE convo_id = ?', (convo_id,))
+
+
+def search(
+    db: sqlite3.Connection, query: str, limit: int = MAX_RESULTS
+) -> list[tuple[str, str | None, str]]:
+    """
+    The best matches of `query` (in FTS5 query syntax, e.g. `polars AND "lazy frame"`)
+    among message text and conversation titles, as `(convo_id, message_id, snippet)`.
+    `message_id` is None for titles. Matched words are wrapped in `**` in snippets.
+    """
+    # Each table's matches are ranked by bm25. The ranks of the two aren't exactly
+    # comparable, but both are better the more often, and the rarer, the words match.
+    return db.execute(
+        f"""
+        SELECT convo_id, message_id, snippet FROM (
+            SELECT * FROM (
+                SELECT
+                    m.convo_id,
+                    m.message_id,
+                    snippet(messages_fts, 0, '**', '**', '…', {SNIPPET_WORDS}) AS snippet,
+                    messages_fts.rank AS rank
+                FROM messages_fts
+                JOIN messages m ON m.rowid = messages_fts.rowid
+                WHERE messages_fts MATCH :query
+                ORDER BY messages_fts.rank
+                LIMIT :limit
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT
+                    c.convo_id,
+                    NULL AS message_id,
+                    snippet(convos_fts, 0, '**', '**', '…', {SNIPPET_WORDS}) AS snippet,
+                    convos_fts.rank AS rank
+                FROM convos_fts
+                JOIN convos c ON c.rowid = convos_fts.rowid
+                WHERE convos_fts MATCH :query
+                ORDER BY convos_fts.rank
+                LIMIT :limit
+            )
+        )
+        ORDER BY rank
+        LIMIT :limit
+        """,
+        {'query': query, 'limit': limit},
+    ).fetchall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Counts the tokens in the `text` of each message row with tiktoken, for the
+`token_count` column. Messages without `text` (e.g. code, thoughts or images) get null.
+
+Each batch's texts are grouped by encoding, and each group is encoded with
+`encode_batch` across `NUM_THREADS` threads, since tiktoken releases the GIL while
+encoding. A message's encoding comes from its `model_slug` (see `MODEL_ENCODINGS`).
+User, system and tool messages don't have one, so they use the encoding of the first
+model in their conversation.
+
+Counts are cached by a hash of their text, both within a run and in `CACHE_PATH`
+between runs, so repeated texts (like tool outputs that come back unchanged) and the
+conversations of a previous export are never encoded again. Like `validation_cache.py`,
+each run rewrites the cache with only the texts it counted, so entries that are no
+longer referenced are evicted.
+"""
+
+import json
+import os
+from typing import Self
+import polars as pl
+import tiktoken
+from polars import col
+from validation_cache import hash_raw
+
+CACHE_PATH = '2-token-counts.cache.json'
+NUM_THREADS = os.cpu_count() or 1
+
+# The encoding of each `model_slug`. Slugs that aren't here use `DEFAULT_ENCODING`.
+MODEL_ENCODINGS: dict[str, str] = {
+    'gpt-4': 'cl100k_base',
+    'gpt-4-all-tools-hogwild-topk': 'cl100k_base',
+    'gpt-4-browsing': 'cl100k_base',
+    'gpt-4-code-interpreter': 'cl100k_base',
+    'gpt-4-dalle': 'cl100k_base',
+    'gpt-4-gizmo': 'cl100k_base',
+    'gpt-4-mobile': 'cl100k_base',
+    'gpt-4-plugins': 'cl100k_base',
+    'text-davinci-002-plugins': 'cl100k_base',
+    'text-davinci-002-render': 'cl100k_base',
+    'text-davinci-002-render-sha': 'cl100k_base',
+    'text-davinci-002-render-sha-mobile': 'cl100k_base',
+}
+DEFAULT_ENCODING = 'o200k_base'
+
+
+class TokenCounter:
+    def __init__(self, cache: dict[str, dict[str, int]] | None = None):
+        # `{encoding: {text hash: count}}` from the previous run
+        self.cache = cache or {}
+        # The same, for the texts counted in this run
+        self.counts: dict[str, dict[str, int]] = {}
+
+    @classmethod
+    def load(cls, path: str = CACHE_PATH) -> Self:
+        "With the counts cached by the previous run, if it used the same tiktoken"
+        try:
+            with open(path, 'r') as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        if cache['fingerprint'] != tiktoken.__version__:
+            return cls()
+        return cls(cache['entries'])
+
+    def save(self, path: str = CACHE_PATH) -> None:
+        with open(path, 'w') as f:
+            json.dump({'fingerprint': tiktoken.__version__, 'entries': self.counts}, f)
+
+    def token_counts(self, df: pl.DataFrame) -> pl.Series:
+        "The `token_count` column of a batch of message rows"
+        encodings = df.select(message_encoding())['encoding'].to_list()
+        counts = self.count(df['text'].to_list(), encodings)
+        return pl.Series('token_count', counts, pl.Int64)
+
+    def count(self, texts: list[str | None], encodings: list[str]) -> list[int | None]:
+        counts: list[int | None] = [None] * len(texts)
+        # The rows of each text that isn't cached yet, by encoding and text hash
+        uncached: dict[str, dict[str, tuple[str, list[int]]]] = {}
+        for i, (text, encoding) in enumerate(zip(texts, encodings)):
+            if text is None:
+                continue
+            text_hash = hash_raw(text)
+            counted = self.counts.setdefault(encoding, {})
+            count = counted.get(text_hash)
+            if count is None:
+                count = self.cache.get(encoding, {}).get(text_hash)
+                if count is not None:
+                    counted[text_hash] = count
+            if count is not None:
+                counts[i] = count
+                continue
+            by_hash = uncached.setdefault(encoding, {})
+            if text_hash in by_hash:
+                by_hash[text_hash][1].append(i)
+            else:
+                by_hash[text_hash] = (text, [i])
+
+        for encoding, by_hash in uncached.items():
+            tokens = tiktoken.get_encoding(encoding).encode_batch(
+                [text for text, _ in by_hash.values()],
+                num_threads=NUM_THREADS,
+                # Count special tokens in the text as plain text
+                disallowed_special=(),
+            )
+            counted = self.counts[encoding]
+            for (text_hash, (_, rows)), text_tokens in zip(by_hash.items(), tokens):
+                counted[text_hash] = len(text_tokens)
+                for i in rows:
+                    counts[i] = len(text_tokens)
+        return counts
+
+
+def load_encodings() -> None:
+    "Loads every encoding that's used, downloading the ones tiktoken hasn't cached yet"
+    for encoding in {DEFAULT_ENCODING, *MODEL_ENCODINGS.values()}:
+        tiktoken.get_encoding(encoding)
+
+
+def message_encoding() -> pl.Expr:
+    """
+    The encoding of each message row. Rows without a `model_slug` get the encoding of
+    the first one in their conversation, or `DEFAULT_ENCODING`.
+    """
+    slug = col('model_slug').cast(pl.String)
+    slug = slug.fill_null(slug.drop_nulls().first().over('convo_id'))
+    return slug.replace_strict(
+        MODEL_ENCODINGS, default=DEFAULT_ENCODING, return_dtype=pl.String
+    ).alias('encoding')
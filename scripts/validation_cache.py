@@ -0,0 +1,72 @@
+"""
+Lets `parse_validate_clean.py` skip validation for conversations that are
+byte-identical to ones in the previous export.
+
+The cache maps a hash of each raw conversation's JSON text to the id of its validated
+`Conversation` in the previous run's store (see `convo_store.py`). The whole cache is
+tied to a fingerprint of the `model` package (plus any settings that affect the
+result), so changing a model invalidates every entry. Each run rewrites the cache
+with only the conversations in the current export, so entries that are no longer
+referenced are evicted.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import pydantic
+import model.conversation
+
+CACHE_PATH = '1-conversations-clean.cache.json'
+
+MODEL_DIR = Path(model.conversation.__file__).parent
+
+
+def model_fingerprint(*settings: object) -> str:
+    """
+    Hash of the source of every module in `model`, the pydantic version, and
+    `settings` (e.g. how many characters UUIDs are shortened to).
+    """
+    h = hashlib.sha256()
+    h.update(pydantic.VERSION.encode())
+    for path in sorted(MODEL_DIR.glob('*.py')):
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+    for setting in settings:
+        h.update(repr(setting).encode())
+    return h.hexdigest()
+
+
+def hash_raw(raw_text: str) -> str:
+    return hashlib.blake2b(raw_text.encode(), digest_size=16).hexdigest()
+
+
+def load_cache(fingerprint: str, path: str = CACHE_PATH) -> dict[str, str]:
+    """
+    Returns the cached `{raw hash: conversation id}` entries, or nothing if there's no
+    cache, or it was written for a different fingerprint.
+    """
+    try:
+        with open(path, 'r') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if cache['fingerprint'] != fingerprint:
+        return {}
+    return cache['entries']
+
+
+def save_cache(
+    fingerprint: str, entries: dict[str, str], path: str = CACHE_PATH
+) -> None:
+    "Like the store, written to a temporary file that then replaces `path`"
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'entries': entries}, f)
+    os.replace(tmp_path, path)
+
+
+def clear_cache(path: str = CACHE_PATH) -> None:
+    "Removes the cache, so no entries point into a store that's being replaced"
+    if os.path.exists(path):
+        os.remove(path)